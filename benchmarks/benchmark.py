@@ -0,0 +1,159 @@
+#
+# End-to-end benchmark. Alerts go through whook's real path: Alert() -> proccessAlert ->
+# updateOrdersQueue -> removeCompletedOrders, against fake exchanges in the same process.
+#
+# Every scenario is run twice:
+#   latency:    one alert at a time, waiting until its orders are filled
+#   throughput: all the alerts at once, waiting until every order is filled
+#
+# Usage:
+#   python benchmarks/benchmark.py                        all scenarios, results printed as JSON
+#   python benchmarks/benchmark.py -s reversals -n 50     a single scenario with 50 alerts
+#   python benchmarks/benchmark.py --latency 0.05 --fill polls:2 --errors 0.05 -o results.json
+#   python benchmarks/benchmark.py --streams --fill after:0.05 --stream-drops 0.1   orders updates pushed through the orders streams
+#
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import simulation
+
+
+# name: ( accounts, symbols, alerts generator ). The generators get the accounts names and return the alert messages
+SCENARIOS = {
+    'single_symbol': ( 1, 50, lambda names, n: [ f"{names[0]} ETHUSDT {'buy' if i % 2 == 0 else 'sell'} 10$ x5" for i in range(n) ] ),
+    'many_symbols': ( 1, 500, lambda names, n: [ f"{names[0]} COIN{4 + i % 496}USDT buy 10$ x5" for i in range(n) ] ),
+    'many_accounts': ( 10, 50, lambda names, n: [ f"allaccounts BTCUSDT {'buy' if i % 2 == 0 else 'sell'} 10$ x5" for i in range(n) ] ),
+    'reversals': ( 1, 50, lambda names, n: [ f"{names[0]} SOLUSDT pos {20 if i % 2 == 0 else -20}$ x{3 + i % 3}" for i in range(n) ] ),
+    'limit_orders': ( 1, 50, lambda names, n: [ f"{names[0]} XRPUSDT buy 10$ x5 limit:bench{i // 2}:90" if i % 2 == 0 else f"{names[0]} XRPUSDT cancel:bench{i // 2}" for i in range(n) ] ),
+    'multi_line': ( 2, 50, lambda names, n: [ f"{names[0]} BTCUSDT buy 10$ x5\n{names[1]} ETHUSDT sell 10$ x5\n{names[0]} SOLUSDT buy 5$ x2" for i in range(n) ] ),
+}
+
+
+def countAccountAlerts( whook, messages )->int:
+    # alerts as seen by the accounts: an 'allaccounts' line counts once for each account
+    count = 0
+    for message in messages:
+        for line in message.split( '\n' ):
+            count += len( whook.accounts ) if whook.ALL_ACCOUNTS in line.lower().split() else 1
+    return count
+
+
+def runScenario( whook, name, numAlerts, exchangeArgs: dict, streamArgs: dict = None )->dict:
+    numAccounts, numSymbols, generator = SCENARIOS[name]
+    names = [ f'{name}{i}' for i in range( numAccounts ) ]
+    accounts = simulation.createAccounts( whook, names, dict( exchangeArgs, numSymbols = numSymbols ) )
+    if( streamArgs != None ):
+        simulation.startOrderStreams( accounts, **streamArgs )
+    messages = generator( names, numAlerts )
+    accountAlerts = countAccountAlerts( whook, messages )
+    result = { 'accounts': numAccounts, 'symbols': numSymbols, 'alerts': len(messages), 'account_alerts': accountAlerts }
+
+    # one at a time
+    latencies = []
+    timeouts = 0
+    simulation.resetCalls( accounts )
+    with simulation.quiet():
+        for message in messages:
+            start = time.monotonic()
+            whook.Alert( message )
+            if( not simulation.runUntilIdle( whook, accounts ) ):
+                timeouts += 1
+            latencies.append( time.monotonic() - start )
+    calls = simulation.totalCalls( accounts )
+    result['latency'] = { 'p50': simulation.percentile( latencies, 50 ),
+                            'p99': simulation.percentile( latencies, 99 ),
+                            'max': max( latencies ),
+                            'mean': sum( latencies ) / len( latencies ),
+                            'timeouts': timeouts }
+    result['api_calls_per_alert'] = calls / accountAlerts
+    callsByMethod = {}
+    for account in accounts:
+        for method, count in account.exchange.calls.items():
+            callsByMethod[method] = callsByMethod.get( method, 0 ) + count
+    result['api_calls'] = callsByMethod
+
+    # all at once
+    simulation.resetCalls( accounts )
+    with simulation.quiet():
+        start = time.monotonic()
+        for message in messages:
+            whook.Alert( message )
+        finished = simulation.runUntilIdle( whook, accounts, timeout = 300.0 )
+        elapsed = time.monotonic() - start
+    result['throughput'] = { 'seconds': elapsed,
+                            'alerts_per_second': len(messages) / elapsed if elapsed > 0 else 0.0,
+                            'account_alerts_per_second': accountAlerts / elapsed if elapsed > 0 else 0.0,
+                            'api_calls_per_alert': simulation.totalCalls( accounts ) / accountAlerts,
+                            'finished': finished }
+
+    if( streamArgs != None ):
+        result['streams'] = { 'received': sum( account.orderStream.received for account in accounts ),
+                            'dropped': sum( account.exchange.stream.dropped for account in accounts ) }
+        simulation.stopOrderStreams( accounts )
+    return result
+
+
+def gitCommit()->str:
+    try:
+        return subprocess.check_output( [ 'git', 'rev-parse', '--short', 'HEAD' ], cwd = simulation.REPO_DIR, stderr = subprocess.DEVNULL ).decode().strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser( description = 'whook end-to-end benchmark against a simulated exchange' )
+    parser.add_argument( '-s', '--scenario', action = 'append', choices = sorted( SCENARIOS.keys() ), help = 'scenario to run (repeatable). All by default' )
+    parser.add_argument( '-n', '--alerts', type = int, default = 20, help = 'alerts per scenario' )
+    parser.add_argument( '--latency', type = float, default = 0.0, help = 'seconds each exchange API call takes' )
+    parser.add_argument( '--jitter', type = float, default = 0.0, help = 'random extra seconds added to the latency' )
+    parser.add_argument( '--fill', default = 'poll', help = "how orders get filled: 'immediate', 'poll' or 'polls:N'" )
+    parser.add_argument( '--errors', type = float, default = 0.0, help = "chance of create_order failing with 'Too Many Requests'" )
+    parser.add_argument( '--exchange-id', default = 'okx', help = 'exchange whook believes it talks to' )
+    parser.add_argument( '--streams', action = 'store_true', help = 'get the orders updates from fake orders streams instead of polling' )
+    parser.add_argument( '--stream-drops', type = float, default = 0.0, help = 'chance of a stream update getting lost' )
+    parser.add_argument( '--stream-failures', type = int, default = 0, help = 'failed connections of each stream before it works' )
+    parser.add_argument( '--batch-orders', action = 'store_true', help = 'send the orders of different symbols in batches (BATCH_ORDERS)' )
+    parser.add_argument( '--poll-fallback', type = float, default = None, help = 'seconds between the polls of orders covered by a stream (ORDER_POLL_FALLBACK)' )
+    parser.add_argument( '-o', '--output', help = 'write the JSON results to this file instead of the console' )
+    args = parser.parse_args()
+
+    latency = args.latency if args.jitter <= 0 else ( args.latency, args.latency + args.jitter )
+    exchangeArgs = { 'id': args.exchange_id, 'latency': latency, 'fillMode': args.fill, 'errorRate': args.errors }
+
+    streamArgs = { 'dropRate': args.stream_drops, 'failures': args.stream_failures } if args.streams else None
+
+    whook = simulation.importWhook( tempfile.mkdtemp( prefix = 'whook_bench_' ) )
+    if( args.poll_fallback != None ):
+        whook.ORDER_POLL_FALLBACK = args.poll_fallback
+    whook.BATCH_ORDERS = args.batch_orders
+    results = { 'commit': gitCommit(),
+                'time': time.strftime( '%Y-%m-%dT%H:%M:%S' ),
+                'python': platform.python_version(),
+                'settings': { 'alerts': args.alerts, 'latency': args.latency, 'jitter': args.jitter, 'fill': args.fill,
+                            'errors': args.errors, 'exchange_id': args.exchange_id, 'streams': streamArgs,
+                            'poll_fallback': whook.ORDER_POLL_FALLBACK, 'batch_orders': whook.BATCH_ORDERS },
+                'scenarios': {} }
+
+    for name in ( args.scenario or SCENARIOS.keys() ):
+        print( f' * {name}...', file = sys.stderr )
+        results['scenarios'][name] = runScenario( whook, name, args.alerts, exchangeArgs, streamArgs )
+
+    whook.shutdown()
+
+    text = json.dumps( results, indent = 2 )
+    if( args.output ):
+        with open( args.output, 'w' ) as f:
+            f.write( text + '\n' )
+    else:
+        print( text )
+
+
+if __name__ == '__main__':
+    main()
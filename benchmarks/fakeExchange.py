@@ -0,0 +1,314 @@
+#
+# In-process stand-in for a ccxt futures exchange. It's good enough for whook to
+# trade against it: markets, balance, prices, positions, leverage and orders.
+#
+# latency:      seconds every API call takes. A ( min, max ) tuple picks a random value for each call
+# fillMode:     'immediate' - create_order returns the order already filled
+#               'poll'      - the order is filled the first time it's fetched
+#               'polls:N'   - the order is filled after being fetched N times
+#               'after:S'   - the order is filled S seconds after being placed (for the orders streams)
+# errorRate:    chance of create_order failing with a 'Too Many Requests' error (whook retries those)
+# bases:        extra base currencies to list, for alerts naming real symbols
+#
+# streamClient() returns a stand-in for the ccxt.pro orders stream (watch_orders) of this exchange.
+#
+
+import asyncio
+import queue
+import random
+import threading
+import time
+import json
+
+import ccxt
+
+
+class fakeExchange_c:
+    def __init__( self, id = 'okx', numSymbols = 50, latency = 0.0, fillMode = 'poll', errorRate = 0.0, seed = 1, bases = () ) -> None:
+        self.id = id
+        self.apiKey = 'fake'
+        self.secret = 'fake'
+        self.password = 'fake'
+        self.enableRateLimit = False
+        self.isSandboxModeEnabled = False
+        self.urls = {}
+        self.currencies = {}
+        self.options = { 'defaultType': 'swap' }
+        self.has = { 'setPositionMode': True, 'setMarginMode': True, 'setLeverage': True, 'fetchLeverage': True,
+                    'fetchPosition': True, 'fetchPositions': True, 'fetchTicker': True, 'fetchBalance': True,
+                    'cancelAllOrders': True, 'createOrders': True }
+        self.markets = {}
+        self.last_http_response = None
+        self.numSymbols = numSymbols
+        self.bases = bases
+        self.latency = latency
+        self.fillMode = fillMode
+        self.errorRate = errorRate
+        self.random = random.Random( seed )
+        self.lock = threading.RLock()
+        self.calls = {}
+        self.orders = {}
+        self.positions = {}
+        self.prices = {}
+        self.leverages = {}
+        self.nextId = 1
+        self.stream = None
+
+    ## helpers ##
+
+    def call( self, name ):
+        with self.lock:
+            self.calls[name] = self.calls.get( name, 0 ) + 1
+        latency = self.latency
+        if( isinstance( latency, tuple ) ):
+            latency = self.random.uniform( latency[0], latency[1] )
+        if( latency > 0 ):
+            time.sleep( latency )
+
+    def respond( self, response ):
+        self.last_http_response = json.dumps( response, default = str )
+        return response
+
+    def streamClient( self, dropRate = 0.0, failures = 0 ):
+        self.stream = fakeOrderStream_c( self, dropRate, failures )
+        return self.stream
+
+    def push( self, order ):
+        if( self.stream != None ):
+            self.stream.push( self.publicOrder( order ) )
+
+    def resetCalls( self ):
+        with self.lock:
+            self.calls = {}
+
+    def totalCalls( self )->int:
+        return sum( self.calls.values() )
+
+    def buildMarkets( self )->dict:
+        markets = {}
+        bases = [ ( 'BTC', 'ETH', 'XRP', 'SOL' )[i] if i < 4 else f'COIN{i}' for i in range( self.numSymbols ) ]
+        bases += [ base for base in self.bases if base not in bases ]
+        for i, base in enumerate( bases ):
+            symbol = f'{base}/USDT:USDT'
+            self.prices[symbol] = 100.0 + i
+            markets[symbol] = { 'id': f'{base}USDT', 'symbol': symbol, 'base': base, 'quote': 'USDT', 'settle': 'USDT',
+                                'type': 'swap', 'swap': True, 'spot': False, 'contract': True, 'linear': True, 'contractSize': 1.0,
+                                'precision': { 'amount': 0.001, 'price': 0.01 },
+                                'limits': { 'amount': { 'min': 0.001 }, 'leverage': { 'max': 100 } },
+                                'info': {} }
+        return markets
+
+    def fill( self, order ):
+        with self.lock:
+            if( order['status'] != 'open' ):
+                return
+            self.fillPosition( order )
+            self.push( order )
+
+    def fillPosition( self, order ):
+        order['status'] = 'closed'
+        order['filled'] = order['amount']
+        order['remaining'] = 0.0
+        symbol = order['symbol']
+        position = self.positions.get( symbol )
+        current = 0.0
+        if( position != None ):
+            current = position['contracts'] if position['side'] == 'long' else -position['contracts']
+        change = order['amount'] if order['side'] == 'buy' else -order['amount']
+        if( order['reduceOnly'] and ( current == 0 or ( current > 0 ) == ( change > 0 ) ) ):
+            return
+        contracts = round( current + change, 8 )
+        if( abs( contracts ) < 1e-9 ):
+            self.positions.pop( symbol, None )
+            return
+        self.positions[symbol] = { 'symbol': symbol, 'contracts': abs( contracts ), 'side': 'long' if contracts > 0 else 'short',
+                                    'leverage': order['leverage'], 'marginMode': 'isolated', 'hedged': False,
+                                    'entryPrice': self.prices[symbol], 'unrealizedPnl': 0.0, 'initialMargin': 1.0,
+                                    'contractSize': 1.0, 'notional': abs( contracts ) * self.prices[symbol], 'info': {} }
+
+    def pollOrder( self, order ):
+        if( order['status'] != 'open' or order['type'] == 'limit' ):
+            return
+        order['polls'] += 1
+        if( self.fillMode == 'poll' ):
+            self.fill( order )
+        elif( self.fillMode.startswith( 'polls:' ) and order['polls'] >= int( self.fillMode[6:] ) ):
+            self.fill( order )
+
+    def publicOrder( self, order )->dict:
+        return { key: value for key, value in order.items() if key not in ( 'polls', 'leverage', 'reduceOnly' ) }
+
+    ## ccxt methods ##
+
+    def load_markets( self, reload = False, params = {} ):
+        self.call( 'load_markets' )
+        self.markets = self.buildMarkets()
+        return self.markets
+
+    def set_markets( self, markets, currencies = None ):
+        self.markets = markets
+        for symbol in markets:
+            self.prices.setdefault( symbol, 100.0 )
+        return markets
+
+    def load_time_difference( self, params = {} ):
+        self.call( 'load_time_difference' )
+        return 0
+
+    def set_sandbox_mode( self, enabled ):
+        self.isSandboxModeEnabled = enabled
+
+    def fetch_balance( self, params = {} ):
+        self.call( 'fetch_balance' )
+        return self.respond( { 'USDT': { 'free': 100000.0, 'used': 0.0, 'total': 100000.0 } } )
+
+    def fetch_ticker( self, symbol, params = {} ):
+        self.call( 'fetch_ticker' )
+        price = self.prices[symbol]
+        return self.respond( { 'symbol': symbol, 'bid': price - 0.01, 'ask': price + 0.01, 'last': price } )
+
+    def fetch_order_book( self, symbol, limit = None, params = {} ):
+        self.call( 'fetch_order_book' )
+        price = self.prices[symbol]
+        return self.respond( { 'symbol': symbol, 'bids': [[price - 0.01, 10.0]], 'asks': [[price + 0.01, 10.0]] } )
+
+    def fetch_positions( self, symbols = None, params = {} ):
+        self.call( 'fetch_positions' )
+        with self.lock:
+            return self.respond( [ dict( p ) for s, p in self.positions.items() if symbols == None or s in symbols ] )
+
+    def fetch_position( self, symbol, params = {} ):
+        self.call( 'fetch_position' )
+        with self.lock:
+            position = self.positions.get( symbol )
+            return self.respond( dict( position ) if position != None else { 'symbol': symbol, 'contracts': 0.0, 'info': {} } )
+
+    def fetch_leverage( self, symbol, params = {} ):
+        self.call( 'fetch_leverage' )
+        return self.respond( { 'info': {}, 'data': { 'marginMode': 'crossed', 'crossMarginLeverage': '5' } } )
+
+    def set_leverage( self, leverage, symbol = None, params = {} ):
+        self.call( 'set_leverage' )
+        self.leverages[symbol] = int( leverage )
+        return self.respond( { 'code': '0', 'retCode': '0' } )
+
+    def set_margin_mode( self, marginMode, symbol = None, params = {} ):
+        self.call( 'set_margin_mode' )
+        return self.respond( { 'code': '0', 'retCode': '0' } )
+
+    def set_position_mode( self, hedged, symbol = None, params = {} ):
+        self.call( 'set_position_mode' )
+        return self.respond( { 'code': '0', 'retCode': '0' } )
+
+    def placeOrder( self, symbol, type, side, amount, price = None, params = {} ):
+        if( self.errorRate > 0 and self.random.random() < self.errorRate ):
+            raise ccxt.ExchangeError( self.id + ' {"code":"429","msg":"Too Many Requests"}' )
+        with self.lock:
+            id = str( self.nextId )
+            self.nextId += 1
+            order = { 'id': id, 'clientOrderId': params.get( 'clientOrderId', id ), 'symbol': symbol, 'type': type, 'side': side,
+                        'amount': amount, 'price': price if price != None else self.prices[symbol], 'status': 'open',
+                        'filled': 0.0, 'remaining': amount, 'polls': 0, 'leverage': int( params.get( 'leverage', self.leverages.get( symbol, 5 ) ) ),
+                        'reduceOnly': bool( params.get( 'reduceOnly', False ) ), 'timestamp': int( time.time() * 1000 ), 'info': {} }
+            self.orders[id] = order
+            self.push( order )
+            if( self.fillMode == 'immediate' and type != 'limit' ):
+                self.fill( order )
+            elif( self.fillMode.startswith( 'after:' ) and type != 'limit' ):
+                timer = threading.Timer( float( self.fillMode[6:] ), self.fill, ( order, ) )
+                timer.daemon = True
+                timer.start()
+            return self.publicOrder( order )
+
+    def create_order( self, symbol, type, side, amount, price = None, params = {} ):
+        self.call( 'create_order' )
+        return self.respond( self.placeOrder( symbol, type, side, amount, price, params ) )
+
+    def create_orders( self, orders, params = {} ):
+        # like the real ones, a rejected order doesn't fail the whole batch
+        self.call( 'create_orders' )
+        responses = []
+        for o in orders:
+            try:
+                responses.append( self.placeOrder( o['symbol'], o['type'], o['side'], o['amount'], o.get( 'price' ), o.get( 'params', {} ) ) )
+            except ccxt.ExchangeError as e:
+                responses.append( { 'id': None, 'status': 'rejected', 'info': { 'code': '429', 'msg': str( e ) } } )
+        return self.respond( responses )
+
+    def fetch_order( self, id, symbol = None, params = {} ):
+        self.call( 'fetch_order' )
+        with self.lock:
+            order = self.orders.get( id )
+            if( order == None ):
+                raise ccxt.OrderNotFound( f'{self.id} order {id} not found' )
+            self.pollOrder( order )
+            return self.respond( self.publicOrder( order ) )
+
+    def fetch_open_orders( self, symbol = None, since = None, limit = None, params = {} ):
+        self.call( 'fetch_open_orders' )
+        with self.lock:
+            return self.respond( [ self.publicOrder( o ) for o in self.orders.values() if o['status'] == 'open' and ( symbol == None or o['symbol'] == symbol ) ] )
+
+    def fetch_closed_orders( self, symbol = None, since = None, limit = None, params = {} ):
+        self.call( 'fetch_closed_orders' )
+        with self.lock:
+            for order in self.orders.values():
+                if( symbol == None or order['symbol'] == symbol ):
+                    self.pollOrder( order )
+            return self.respond( [ self.publicOrder( o ) for o in self.orders.values() if o['status'] == 'closed' and ( symbol == None or o['symbol'] == symbol ) ] )
+
+    def cancel_order( self, id, symbol = None, params = {} ):
+        self.call( 'cancel_order' )
+        with self.lock:
+            for order in self.orders.values():
+                if( ( order['id'] == id or order['clientOrderId'] == id ) and order['status'] == 'open' ):
+                    order['status'] = 'canceled'
+                    self.push( order )
+                    return self.respond( self.publicOrder( order ) )
+        raise ccxt.OrderNotFound( f'{self.id} order {id} not found' )
+
+    def cancel_all_orders( self, symbol = None, params = {} ):
+        self.call( 'cancel_all_orders' )
+        with self.lock:
+            for order in self.orders.values():
+                if( order['status'] == 'open' and ( symbol == None or order['symbol'] == symbol ) ):
+                    order['status'] = 'canceled'
+                    self.push( order )
+        return self.respond( {} )
+
+
+class fakeOrderStream_c:
+    # what whook's orderStream_c needs from a ccxt.pro exchange: the coroutines watch_orders() and close()
+    # dropRate: chance of an update getting lost (whook's fallback polls have to catch it)
+    # failures: how many watch_orders calls fail before it connects
+    def __init__( self, exchange, dropRate = 0.0, failures = 0 ) -> None:
+        self.exchange = exchange
+        self.dropRate = dropRate
+        self.failures = failures
+        self.pending = queue.Queue()
+        self.dropped = 0
+        self.closed = False
+
+    def push( self, order ):
+        if( self.dropRate > 0 and self.exchange.random.random() < self.dropRate ):
+            self.dropped += 1
+            return
+        self.pending.put( dict( order ) )
+
+    async def watch_orders( self, symbol = None, since = None, limit = None, params = {} ):
+        if( self.failures > 0 ):
+            self.failures -= 1
+            raise ccxt.NetworkError( self.exchange.id + ' orders stream disconnected' )
+        while True:
+            orders = []
+            while True:
+                try:
+                    orders.append( self.pending.get_nowait() )
+                except queue.Empty:
+                    break
+            if( len( orders ) ):
+                return orders
+            await asyncio.sleep( 0.002 )
+
+    async def close( self ):
+        self.closed = True
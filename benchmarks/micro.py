@@ -0,0 +1,294 @@
+#
+# Microbenchmarks for the CPU work done on every alert (parsing, symbol lookup, quantity math)
+# and for the positions formatting used by the dashboard.
+#
+# They run against a fake exchange with a realistic markets table (600 symbols with different
+# contract sizes and precisions) and a generated alerts corpus. A corpus of real alerts can be
+# used instead, one alert per line.
+#
+# Usage:
+#   python benchmarks/micro.py run                       print the results
+#   python benchmarks/micro.py save                      store the results as the baseline
+#   python benchmarks/micro.py compare                   compare against the baseline. Exits with 1 on regressions
+#   python benchmarks/micro.py compare -b other.json -k parse
+#
+# Results are nanoseconds per operation, the best of several repeats. Each benchmark has a fixed
+# threshold: a result slower than baseline * threshold is a regression.
+#
+
+import argparse
+import gc
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import simulation
+
+
+BASELINE_FILE = os.path.join( simulation.BENCHMARKS_DIR, 'baseline.json' )
+NUM_SYMBOLS = 600
+DEFAULT_THRESHOLD = 1.25
+
+# benchmarks doing very little work per operation are noisier
+THRESHOLDS = {
+    'stringToValue': 1.50,
+    'findSymbolFromPairName': 1.50,
+    'findSymbolFromPairName_cold': 1.50,
+}
+
+PRECISIONS = ( 0.001, 0.01, 0.1, 1.0, 0.0001, 10.0 )
+CONTRACT_SIZES = ( 1.0, 0.01, 0.001, 10.0, 100.0 )
+
+
+##### data #####
+
+def buildMarketsVariety( account, rng ):
+    # the fake markets are all alike. Real ones aren't
+    for i, market in enumerate( account.markets.values() ):
+        market['precision']['amount'] = PRECISIONS[i % len(PRECISIONS)]
+        market['contractSize'] = CONTRACT_SIZES[i % len(CONTRACT_SIZES)]
+        market['local']['leverage'] = rng.choice( ( 3, 5, 10, 20 ) )
+        market['local']['marginMode'] = 'isolated'
+
+
+def pairNameVariants( market )->list:
+    base = market['base']
+    return [ f'{base}USDT', f'{base}USDT.P', f'{base}/USDT', f'{base}/USDT:USDT', f'{base.lower()}usdt' ]
+
+
+def generateCorpus( accountName, markets, rng, size = 2000 )->list:
+    corpus = []
+    for i in range( size ):
+        pair = rng.choice( pairNameVariants( rng.choice( markets ) ) )
+        leverage = rng.choice( ( f'x{rng.randint(1, 20)}', f'{rng.randint(1, 20)}x' ) )
+        kind = rng.randint( 0, 9 )
+        if( kind < 3 ):
+            line = f"{accountName} {pair} {rng.choice( ( 'buy', 'sell' ) )} {rng.randint(5, 500)}$ {leverage}"
+        elif( kind < 5 ):
+            line = f"{accountName} {pair} pos {rng.choice( ( -1, 1 ) ) * rng.randint(5, 500)}$ {leverage}"
+        elif( kind == 5 ):
+            line = f"{pair} position {round( rng.uniform( -50, 50 ), 3 )} {leverage} {accountName}"
+        elif( kind == 6 ):
+            line = f"{accountName} {pair} {rng.choice( ( 'buy', 'sell' ) )} {rng.randint(1, 10)}% {leverage} limit:id{i}:{round( rng.uniform( 1, 1000 ), 2 )}"
+        elif( kind == 7 ):
+            line = f"{accountName} {pair} cancel:{rng.choice( ( 'all', f'id{i}' ) )}"
+        elif( kind == 8 ):
+            line = f"{accountName} {pair} close {rng.choice( ( '', '50%', '33.3%' ) )}".rstrip()
+        else:
+            line = f"{accountName} {pair} sell {rng.randint(1, 100)}@ {leverage} reduceonly"
+        corpus.append( line )
+    return corpus
+
+
+def generatePositions( whook, account, rng, count = 100 )->list:
+    positions = []
+    for symbol in rng.sample( list( account.markets.keys() ), count ):
+        contracts = float( rng.randint( 1, 1000 ) )
+        entryPrice = round( rng.uniform( 0.0001, 60000 ), 4 )
+        position = { 'symbol': symbol, 'side': rng.choice( ( 'long', 'short' ) ), 'contracts': contracts,
+                    'entryPrice': entryPrice, 'liquidationPrice': entryPrice * 0.8, 'unrealizedPnl': rng.uniform( -50, 50 ),
+                    'initialMargin': rng.uniform( 10, 500 ), 'realizedPnl': rng.uniform( -10, 10 ), 'marginMode': 'isolated',
+                    'info': { 'breakEvenPrice': str( entryPrice * 1.001 ) } }
+        positions.append( whook.position_c( symbol, position, account.markets[symbol] ) )
+    return positions
+
+
+##### benchmarks #####
+
+def buildBenchmarks( whook, account, corpus, rng )->dict:
+    # name: ( function running a batch, operations in the batch )
+    symbols = list( account.markets.keys() )
+    markets = list( account.markets.values() )
+    pairs = [ rng.choice( pairNameVariants( rng.choice( markets ) ) ) for i in range( 1000 ) ]
+    tokens = [ token for line in corpus[:300] for token in line.split() ]
+    numbers = [ rng.choice( ( str( rng.randint( -1000, 1000 ) ), str( round( rng.uniform( -100, 100 ), 4 ) ), 'buy', 'x5', '10$' ) ) for i in range( 1000 ) ]
+    quantities = [ ( rng.choice( symbols ), rng.uniform( 5, 5000 ), rng.uniform( 0.0001, 60000 ), rng.choice( ( 1.0, 3.0, 10.0 ) ) ) for i in range( 1000 ) ]
+    ticks = [ ( rng.uniform( -1000, 1000 ), str( rng.choice( PRECISIONS ) ) ) for i in range( 1000 ) ]
+    positions = generatePositions( whook, account, rng )
+    # the same alerts come again and again. Few enough for them to stay in the parsed alerts cache
+    repeated = corpus[:min( 200, whook.ALERTS_CACHE_SIZE )]
+
+    def parseCached():
+        for line in repeated:
+            whook.parseAlert( line, account )
+
+    def parseUncached():
+        for line in corpus:
+            whook.parseAlertTokens( line, account )
+
+    def findSymbol():
+        for pair in pairs:
+            account.findSymbolFromPairName( pair )
+
+    def findSymbolCold():
+        account.pairNamesCache.clear()
+        for token in tokens:
+            account.findSymbolFromPairName( token )
+
+    def stringToValue():
+        for n in numbers:
+            whook.stringToValue( n )
+
+    def contractsFromUSDT():
+        for symbol, amount, price, leverage in quantities:
+            account.contractsFromUSDT( symbol, amount, price, leverage )
+
+    def roundTicks( function ):
+        def run():
+            for value, tick in ticks:
+                function( value, tick )
+        return run
+
+    def generateDictionary():
+        for p in positions:
+            p.generateDictionary()
+
+    def generatePrintString():
+        for p in positions:
+            p.generatePrintString()
+
+    return { 'parseAlert': ( parseCached, len(repeated) ),
+            'parseAlertTokens': ( parseUncached, len(corpus) ),
+            'findSymbolFromPairName': ( findSymbol, len(pairs) ),
+            'findSymbolFromPairName_cold': ( findSymbolCold, len(tokens) ),
+            'stringToValue': ( stringToValue, len(numbers) ),
+            'contractsFromUSDT': ( contractsFromUSDT, len(quantities) ),
+            'roundUpTick': ( roundTicks( whook.roundUpTick ), len(ticks) ),
+            'roundDownTick': ( roundTicks( whook.roundDownTick ), len(ticks) ),
+            'roundToTick': ( roundTicks( whook.roundToTick ), len(ticks) ),
+            'position_generateDictionary': ( generateDictionary, len(positions) ),
+            'position_generatePrintString': ( generatePrintString, len(positions) ) }
+
+
+def measure( function, operations, repeats, minTime = 0.05 )->float:
+    # nanoseconds per operation, best of the repeats. Each repeat runs the batch enough times to last minTime
+    function() # warm up
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for i in range( loops ):
+            function()
+        if( time.perf_counter() - start >= minTime ):
+            break
+        loops *= 2
+
+    # like timeit, don't let the garbage collector land in the middle of one benchmark
+    best = None
+    gcEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        for r in range( repeats ):
+            start = time.perf_counter_ns()
+            for i in range( loops ):
+                function()
+            elapsed = ( time.perf_counter_ns() - start ) / ( loops * operations )
+            best = elapsed if best == None else min( best, elapsed )
+    finally:
+        if gcEnabled:
+            gc.enable()
+    return best
+
+
+def runBenchmarks( args )->dict:
+    corpusFile = os.path.abspath( args.corpus ) if args.corpus else None
+    rng = random.Random( 1 )
+    whook = simulation.importWhook( tempfile.mkdtemp( prefix = 'whook_micro_' ) )
+    account = simulation.createAccounts( whook, [ 'micro' ], { 'numSymbols': NUM_SYMBOLS } )[0]
+    buildMarketsVariety( account, rng )
+
+    if( corpusFile ):
+        import replay
+        corpus = [ e.text for e in replay.readCorpus( corpusFile ) ]
+    else:
+        corpus = generateCorpus( account.accountName, list( account.markets.values() ), rng )
+
+    results = {}
+    with simulation.quiet():
+        for name, ( function, operations ) in buildBenchmarks( whook, account, corpus, rng ).items():
+            if( args.filter and args.filter not in name ):
+                continue
+            print( f' * {name}...', file = sys.stderr )
+            results[name] = measure( function, operations, args.repeats )
+    whook.shutdown()
+
+    return { 'commit': gitCommit(),
+            'time': time.strftime( '%Y-%m-%dT%H:%M:%S' ),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'symbols': len( account.markets ),
+            'corpus': corpusFile if corpusFile else f'generated:{len(corpus)}',
+            'ns_per_op': results }
+
+
+def gitCommit()->str:
+    import benchmark
+    return benchmark.gitCommit()
+
+
+def compare( baseline: dict, current: dict )->bool:
+    # prints the comparison table. Returns False when something regressed
+    ok = True
+    print( f"{'benchmark':<32}{'baseline':>12}{'current':>12}{'ratio':>8}{'limit':>8}" )
+    for name, value in current['ns_per_op'].items():
+        base = baseline['ns_per_op'].get( name )
+        if( base == None ):
+            print( f"{name:<32}{'-':>12}{value:>12.1f}{'':>8}{'':>8}  new" )
+            continue
+        ratio = value / base
+        limit = THRESHOLDS.get( name, DEFAULT_THRESHOLD )
+        status = ''
+        if( ratio > limit ):
+            status = '  REGRESSION'
+            ok = False
+        elif( ratio < 1.0 / limit ):
+            status = '  faster'
+        print( f"{name:<32}{base:>12.1f}{value:>12.1f}{ratio:>8.2f}{limit:>8.2f}{status}" )
+    if( baseline.get( 'python' ) != current.get( 'python' ) or baseline.get( 'machine' ) != current.get( 'machine' ) ):
+        print( f"\n * W: baseline from python {baseline.get('python')} on {baseline.get('machine')}. Results may not be comparable" )
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser( description = 'whook microbenchmarks' )
+    parser.add_argument( 'command', nargs = '?', default = 'run', choices = ( 'run', 'save', 'compare' ) )
+    parser.add_argument( '-b', '--baseline', default = BASELINE_FILE, help = 'baseline file to save or compare against' )
+    parser.add_argument( '-k', '--filter', help = 'only run the benchmarks whose name contains this' )
+    parser.add_argument( '-r', '--repeats', type = int, default = 7, help = 'repeats of each benchmark. The best one is kept' )
+    parser.add_argument( '--corpus', help = 'file with one alert per line to parse instead of the generated corpus' )
+    parser.add_argument( '-o', '--output', help = 'also write the JSON results to this file' )
+    args = parser.parse_args()
+
+    baselineFile = os.path.abspath( args.baseline )
+    output = os.path.abspath( args.output ) if args.output else None
+
+    baseline = None
+    if( args.command == 'compare' ):
+        if( not os.path.exists( baselineFile ) ):
+            parser.error( f'no baseline at {baselineFile}. Create it with the save command' )
+        with open( baselineFile ) as f:
+            baseline = json.load( f )
+
+    results = runBenchmarks( args )
+    text = json.dumps( results, indent = 2 )
+    if( output ):
+        with open( output, 'w' ) as f:
+            f.write( text + '\n' )
+
+    if( args.command == 'save' ):
+        with open( baselineFile, 'w' ) as f:
+            f.write( text + '\n' )
+        print( f' * baseline saved to {baselineFile}', file = sys.stderr )
+    elif( args.command == 'compare' ):
+        if( not compare( baseline, results ) ):
+            sys.exit( 1 )
+        return
+
+    print( text )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,316 @@
+#
+# Replays recorded alerts into whook's Alert() against fake exchanges in the same process.
+#
+# The alerts can be taken from the accounts logs (every 'ALERT:' line, text or LOG_JSON format)
+# or from a plain corpus file with one alert per line. Logs keep the time of each alert, so
+# they can be replayed at their original pace, accelerated, or as fast as possible. A corpus
+# has no times and is always replayed at maximum speed.
+#
+# For every alert it measures:
+#   parse:   parsing the alert line (uncached parseAlertTokens)
+#   process: the Alert() call itself, which sends the orders
+#   settle:  from the end of Alert() until every order is filled (missing if the next alert came first)
+#
+# Usage:
+#   python benchmarks/replay.py logs/                              every log in the directory, original pace
+#   python benchmarks/replay.py logs/myBitget.log --speed 60       one minute of traffic per second
+#   python benchmarks/replay.py --speed max logs/ -o replay.json   as fast as possible, per alert results to a file
+#   python benchmarks/replay.py --corpus alerts.txt --accounts myBitget,myKucoin
+#
+
+import argparse
+import json
+import os
+import re
+import sys
+import tempfile
+import time
+
+import simulation
+
+
+# [2024/03/01][12:00:00]  ALERT: myBitget ETHUSDT buy 10$ x5
+TEXT_ALERT = re.compile( r'^\[(\d{4}/\d{2}/\d{2})\]\[(\d{2}:\d{2}:\d{2})\]\s+ALERT:\s?(.*)$' )
+SETTLE_TIMEOUT = 60.0
+
+
+class entry_c:
+    def __init__( self, timestamp, account, text, source = None ) -> None:
+        self.timestamp = timestamp  # seconds since epoch. None for corpus entries
+        self.account = account      # account that logged it. None for corpus entries
+        self.text = text
+        self.source = source        # log file it was read from
+
+
+def accountFromLogName( path )->str:
+    # myBitget.log, myBitget.log.1 and myBitget.log.2024-03-01 (rotated) all belong to myBitget
+    name = os.path.basename( path )
+    return name[:name.index( '.log' )] if '.log' in name else os.path.splitext( name )[0]
+
+
+def readLogFile( path )->list:
+    entries = []
+    account = accountFromLogName( path )
+    with open( path, encoding = 'utf-8', errors = 'replace' ) as f:
+        for line in f:
+            line = line.rstrip( '\n' )
+            if( line.startswith( '{' ) ):
+                try:
+                    record = json.loads( line )
+                except ValueError:
+                    continue
+                message = record.get( 'message', '' ).strip()
+                if( not message.startswith( 'ALERT:' ) ):
+                    continue
+                entries.append( entry_c( float( record['time'] ), record.get( 'account' ) or account, message[6:].strip(), path ) )
+                continue
+
+            match = TEXT_ALERT.match( line )
+            if( match == None ):
+                continue
+            timestamp = time.mktime( time.strptime( match.group(1) + ' ' + match.group(2), '%Y/%m/%d %H:%M:%S' ) )
+            entries.append( entry_c( timestamp, account, match.group(3).strip(), path ) )
+    return entries
+
+
+def readLogs( paths )->tuple:
+    # returns the entries to replay and the names of every account found in the logs
+    entries = []
+    for path in paths:
+        if( os.path.isdir( path ) ):
+            for name in sorted( os.listdir( path ) ):
+                if( '.log' in name ):
+                    entries += readLogFile( os.path.join( path, name ) )
+        else:
+            entries += readLogFile( path )
+
+    names = []
+    for e in entries:
+        if( e.account not in names ):
+            names.append( e.account )
+
+    # an 'allaccounts' alert is logged by every account. Replay it once: drop the copies
+    # logged by the other files in the same second. The same alert repeated in one file is kept
+    entries.sort( key = lambda e: e.timestamp )
+    unique = []
+    firstSource = {}
+    for e in entries:
+        if( 'allaccounts' in e.text.lower().split() ):
+            key = ( e.timestamp, e.text )
+            if( firstSource.setdefault( key, e.source ) != e.source ):
+                continue
+        unique.append( e )
+    return [ e for e in unique if len( e.text ) > 0 ], names
+
+
+def readCorpus( path )->list:
+    entries = []
+    with open( path, encoding = 'utf-8' ) as f:
+        for line in f:
+            line = line.strip()
+            if( len( line ) == 0 or line[:2] == '//' ):
+                continue
+            entries.append( entry_c( None, None, line ) )
+    return entries
+
+
+def guessBases( entries )->list:
+    # the fake exchange has to list the symbols the alerts name: ETHUSDT, ETH/USDT, ETH/USDT:USDT, ETHUSDT.P, ETHUSDTM
+    bases = []
+    for e in entries:
+        for token in e.text.split():
+            token = token.upper()
+            if( ':' in token and not token.endswith( ':USDT' ) ):
+                continue
+            token = token.split( ':' )[0].replace( '/', '' ).replace( '.P', '' )
+            base = None
+            if( token.endswith( 'USDTM' ) and len( token ) > 5 ):
+                base = token[:-5]
+            elif( token.endswith( 'USDT' ) and len( token ) > 4 ):
+                base = token[:-4]
+            if( base != None and base.isalnum() and base not in bases ):
+                bases.append( base )
+    return bases
+
+
+def alertShape( whook, text, names )->str:
+    # the alert with its variable parts replaced, so alerts doing the same thing group together
+    account = whook.accountsByName.get( names[0].lower() ) if len( names ) else None
+    shape = []
+    for token in text.split():
+        lower = token.lower()
+        if( lower in names or lower == whook.ALL_ACCOUNTS ):
+            shape.append( '<account>' if lower != whook.ALL_ACCOUNTS else lower )
+        elif( re.match( r'^-?[\d.]+[$%@]?$', lower ) ):
+            shape.append( 'N' + ( lower[-1] if lower[-1] in '$%@' else '' ) )
+        elif( re.match( r'^(x[\d.]+|[\d.]+x)$', lower ) ):
+            shape.append( 'xN' )
+        elif( lower.startswith( 'limit:' ) ):
+            shape.append( 'limit:ID:N' )
+        elif( lower.startswith( 'cancel:' ) ):
+            shape.append( 'cancel:all' if lower == 'cancel:all' else 'cancel:ID' )
+        elif( account != None and account.findSymbolFromPairName( token ) != None ):
+            shape.append( '<symbol>' )
+        else:
+            shape.append( lower )
+    return ' '.join( shape )
+
+
+def parseSpeed( value )->float:
+    # original -> 1.0, max -> 0 (no waiting), otherwise an acceleration factor
+    if( value == 'original' ):
+        return 1.0
+    if( value == 'max' ):
+        return 0.0
+    speed = float( value )
+    if( speed <= 0 ):
+        raise argparse.ArgumentTypeError( 'speed must be positive' )
+    return speed
+
+
+def tickUntil( whook, accounts, deadline )->bool:
+    # run the orders workers until every account is idle or the deadline is reached. Returns True when idle
+    while True:
+        busy = False
+        for account in accounts:
+            if( not simulation.isIdle( account ) ):
+                busy = True
+                whook.ordersWorkerFrame( account )
+        if( not busy ):
+            return True
+        if( time.monotonic() >= deadline ):
+            return False
+        time.sleep( 0 )
+
+
+def summarize( values )->dict:
+    if( len( values ) == 0 ):
+        return None
+    return { 'p50': simulation.percentile( values, 50 ),
+            'p99': simulation.percentile( values, 99 ),
+            'max': max( values ),
+            'mean': sum( values ) / len( values ) }
+
+
+def replay( whook, entries, accounts, names, speed, numShapes = 10 )->dict:
+    results = []
+    firstTime = entries[0].timestamp
+    start = time.monotonic()
+
+    def dueTime( e ):
+        if( speed == 0 or e.timestamp == None ):
+            return None
+        return start + ( e.timestamp - firstTime ) / speed
+
+    for i, e in enumerate( entries ):
+        due = dueTime( e )
+        if( due != None ):
+            tickUntil( whook, accounts, due )
+            while time.monotonic() < due:
+                time.sleep( min( 0.01, due - time.monotonic() ) )
+
+        # parsing, on its own. Alert() parses again through the accounts cache
+        account = whook.accountsByName.get( e.account.lower() ) if e.account != None else None
+        if( account == None ):
+            account = next( ( a for a in accounts if a.accountName.lower() in e.text.lower().split() ), accounts[0] )
+        t0 = time.perf_counter()
+        parsed = whook.parseAlertTokens( e.text, account )
+        t1 = time.perf_counter()
+        whook.Alert( e.text )
+        t2 = time.perf_counter()
+
+        nextDue = dueTime( entries[i + 1] ) if i + 1 < len( entries ) else None
+        settled = tickUntil( whook, accounts, nextDue if nextDue != None else time.monotonic() + SETTLE_TIMEOUT )
+        t3 = time.perf_counter()
+
+        results.append( { 'alert': e.text,
+                        'account': e.account,
+                        'time': e.timestamp,
+                        'shape': alertShape( whook, e.text, names ),
+                        'error': parsed.get( 'Error' ),
+                        'parse': t1 - t0,
+                        'process': t2 - t1,
+                        'settle': t3 - t2 if settled else None } )
+
+    elapsed = time.monotonic() - start
+
+    # slowest alert shapes by mean time until settled
+    shapes = {}
+    for r in results:
+        shapes.setdefault( r['shape'], [] ).append( r )
+    slowest = []
+    for shape, rs in shapes.items():
+        totals = [ r['process'] + r['settle'] for r in rs if r['settle'] != None ]
+        slowest.append( { 'shape': shape,
+                        'count': len( rs ),
+                        'mean_parse': sum( r['parse'] for r in rs ) / len( rs ),
+                        'mean_process': sum( r['process'] for r in rs ) / len( rs ),
+                        'mean_total': sum( totals ) / len( totals ) if len( totals ) else None } )
+    slowest.sort( key = lambda s: s['mean_total'] if s['mean_total'] != None else s['mean_process'], reverse = True )
+
+    return { 'alerts': len( results ),
+            'parse_errors': sum( 1 for r in results if r['error'] != None ),
+            'unsettled': sum( 1 for r in results if r['settle'] == None ),
+            'seconds': elapsed,
+            'alerts_per_second': len( results ) / elapsed if elapsed > 0 else 0.0,
+            'parse': summarize( [ r['parse'] for r in results ] ),
+            'process': summarize( [ r['process'] for r in results ] ),
+            'settle': summarize( [ r['settle'] for r in results if r['settle'] != None ] ),
+            'slowest_shapes': slowest[:numShapes],
+            'per_alert': results }
+
+
+def main():
+    parser = argparse.ArgumentParser( description = 'replay recorded whook alerts against a simulated exchange' )
+    parser.add_argument( 'logs', nargs = '*', help = 'account log files or logs directories' )
+    parser.add_argument( '--corpus', help = 'plain file with one alert per line, instead of logs' )
+    parser.add_argument( '--accounts', help = 'comma separated account names to create. Taken from the logs by default' )
+    parser.add_argument( '--speed', type = parseSpeed, default = 1.0, help = "'original', 'max' or an acceleration factor (10 = ten times faster)" )
+    parser.add_argument( '--limit', type = int, default = 0, help = 'replay only the first N alerts' )
+    parser.add_argument( '--symbols', type = int, default = 50, help = 'generated markets in each fake exchange, besides the ones the alerts name' )
+    parser.add_argument( '--latency', type = float, default = 0.0, help = 'seconds each exchange API call takes' )
+    parser.add_argument( '--jitter', type = float, default = 0.0, help = 'random extra seconds added to the latency' )
+    parser.add_argument( '--fill', default = 'poll', help = "how orders get filled: 'immediate', 'poll' or 'polls:N'" )
+    parser.add_argument( '--exchange-id', default = 'okx', help = 'exchange whook believes it talks to' )
+    parser.add_argument( '--shapes', type = int, default = 10, help = 'how many of the slowest alert shapes to report' )
+    parser.add_argument( '-o', '--output', help = 'write the full JSON results, including every alert, to this file' )
+    args = parser.parse_args()
+
+    names = [ n for n in args.accounts.split( ',' ) if len( n ) ] if args.accounts else []
+    if( args.corpus ):
+        entries = readCorpus( args.corpus )
+    elif( len( args.logs ) ):
+        entries, logNames = readLogs( args.logs )
+        names += [ n for n in logNames if n not in names ]
+    else:
+        parser.error( 'give some log files or a --corpus' )
+    if( args.limit > 0 ):
+        entries = entries[:args.limit]
+    if( len( entries ) == 0 ):
+        parser.error( 'no alerts found' )
+    if( len( names ) == 0 ):
+        parser.error( 'a corpus needs --accounts' )
+
+    # logs directories given with relative paths must be read before importing whook, which changes the working directory
+    latency = args.latency if args.jitter <= 0 else ( args.latency, args.latency + args.jitter )
+    exchangeArgs = { 'id': args.exchange_id, 'numSymbols': args.symbols, 'latency': latency, 'fillMode': args.fill, 'bases': guessBases( entries ) }
+    output = os.path.abspath( args.output ) if args.output else None
+
+    whook = simulation.importWhook( tempfile.mkdtemp( prefix = 'whook_replay_' ) )
+    accounts = simulation.createAccounts( whook, names, exchangeArgs )
+    print( f' * replaying {len(entries)} alerts into {len(accounts)} accounts...', file = sys.stderr )
+    with simulation.quiet():
+        results = replay( whook, entries, accounts, [ n.lower() for n in names ], args.speed, args.shapes )
+    whook.shutdown()
+
+    results['settings'] = { 'speed': args.speed, 'accounts': names, 'symbols': args.symbols, 'latency': args.latency,
+                            'jitter': args.jitter, 'fill': args.fill, 'exchange_id': args.exchange_id }
+    if( output ):
+        with open( output, 'w' ) as f:
+            f.write( json.dumps( results, indent = 2 ) + '\n' )
+    del results['per_alert']
+    print( json.dumps( results, indent = 2 ) )
+
+
+if __name__ == '__main__':
+    main()
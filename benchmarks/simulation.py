@@ -0,0 +1,101 @@
+#
+# Runs whook in-process against fakeExchange_c. Shared by the benchmark tools.
+#
+
+import contextlib
+import os
+import sys
+import time
+
+BENCHMARKS_DIR = os.path.dirname( os.path.abspath( __file__ ) )
+REPO_DIR = os.path.dirname( BENCHMARKS_DIR )
+
+if( REPO_DIR not in sys.path ):
+    sys.path.insert( 0, REPO_DIR )
+
+from fakeExchange import fakeExchange_c
+
+
+def importWhook( workDir ):
+    # whook reads config.json from the working directory (and writes it when missing)
+    os.makedirs( workDir, exist_ok = True )
+    os.chdir( workDir )
+    with quiet():
+        import main as whook
+
+    whook.LOGS_DIRECTORY = os.path.join( workDir, 'logs' )
+    whook.CACHE_DIRECTORY = os.path.join( workDir, 'cache' )
+    # every run starts cold and the same way
+    whook.MARKETS_CACHE_TTL = 0
+    whook.LOCAL_STATE_TTL = 0
+    whook.verbose = False
+    return whook
+
+
+@contextlib.contextmanager
+def quiet():
+    # whook prints every step to the console. It costs time we don't want to measure
+    with open( os.devnull, 'w' ) as devnull:
+        with contextlib.redirect_stdout( devnull ):
+            yield
+
+
+def createAccounts( whook, names, exchangeArgs: dict )->list:
+    # replaces the whook accounts with new ones, each with its own fake exchange
+    stopOrderStreams( whook.accounts )
+    whook.accounts.clear()
+    with quiet():
+        for name in names:
+            whook.accounts.append( whook.account_c( fakeExchange_c( **exchangeArgs ), name ) )
+    whook.rebuildAccountsIndex()
+    return list( whook.accounts )
+
+
+def startOrderStreams( accounts, dropRate = 0.0, failures = 0 ):
+    # get the orders updates pushed by the fake exchanges instead of polling them
+    with quiet():
+        for account in accounts:
+            account.startOrderStream( account.exchange.streamClient( dropRate, failures ) )
+
+
+def stopOrderStreams( accounts ):
+    for account in accounts:
+        if( account.orderStream != None ):
+            account.orderStream.stop()
+            account.orderStream = None
+
+
+def isIdle( account )->bool:
+    return len( account.ordersQueue ) == 0 and len( account.activeOrders ) == 0 and len( account.latchedAlerts ) == 0
+
+
+def runUntilIdle( whook, accounts, timeout = 60.0 )->bool:
+    # run the orders workers frames back to back until every account is done. Returns False on timeout
+    start = time.monotonic()
+    while True:
+        busy = False
+        for account in accounts:
+            if( not isIdle( account ) ):
+                busy = True
+                whook.ordersWorkerFrame( account )
+        if( not busy ):
+            return True
+        if( time.monotonic() - start > timeout ):
+            return False
+        time.sleep( 0 )
+
+
+def totalCalls( accounts )->int:
+    return sum( account.exchange.totalCalls() for account in accounts )
+
+
+def resetCalls( accounts ):
+    for account in accounts:
+        account.exchange.resetCalls()
+
+
+def percentile( values, p )->float:
+    values = sorted( values )
+    if( len(values) == 0 ):
+        return 0.0
+    return values[ min( int( len(values) * p / 100.0 ), len(values) - 1 ) ]
@@ -3,13 +3,21 @@
 import ccxt
 from flask import Flask, request, abort, jsonify
 from werkzeug.middleware.proxy_fix import ProxyFix
-from threading import Timer
+from threading import Timer, Thread, RLock
+from collections import deque
+import queue
+from concurrent.futures import Future, wait
 import os
 import time
 import os
 import json
+import hashlib
 import copy
+import re
+import bisect
+import asyncio
 import logging
+import logging.handlers
 from datetime import datetime
 from decimal import Decimal, ROUND_CEILING, ROUND_FLOOR, ROUND_HALF_EVEN
 from pprint import pprint
@@ -45,10 +53,39 @@ PROXY_PORT = 50000
 ALERT_TIMEOUT = 60 * 3
 ORDER_TIMEOUT = 40
 REFRESH_POSITIONS_FREQUENCY = 5 * 60    # refresh positions every 5 minutes
+DASHBOARD_MAX_STALENESS = 6 * 60        # the positions page is served from the last refresh unless it's older than this
+API_STATS_LOG_FREQUENCY = 60 * 60       # write a summary of the exchange API calls timings to the account logs this often. 0 disables it
+ACCOUNT_REPORT_TIMEOUT = 10.0           # ?response=allaccounts returns the last known data of the accounts which take longer than this
 UPDATE_ORDERS_FREQUENCY = 0.2           # frametime in seconds at which the orders queue is refreshed.
 LOGS_DIRECTORY = 'logs'
+LOG_JSON = False                        # write the account logs as JSON lines
+LOG_MAX_BYTES = 0                       # rotate the account logs when they reach this size. 0 disables it
+LOG_ROTATE_WHEN = ''                    # or rotate them by time: 'midnight', 'h', 'd', 'w0'... (see logging.handlers.TimedRotatingFileHandler)
+LOG_BACKUP_COUNT = 5                    # rotated logs to keep
+CACHE_DIRECTORY = 'cache'
+MARKETS_CACHE_TTL = 24 * 60 * 60        # discard the cached markets after one day
+LOCAL_STATE_TTL = 6 * 60 * 60           # trust the saved leverage, marginMode and positionMode of each market for this long after a restart. 0 disables it
+MARKETS_CACHE_VERSION = 1
+INIT_THREADS = 8                        # accounts initialized at once. 1 initializes them one by one
+INIT_TIMEOUT = 120                      # give up on an account which takes longer than this to initialize. Its thread is abandoned and won't delay the shutdown
+ASYNC_ALERTS = False                    # answer the webhook inmediately and process the alerts in the background
+ALERT_WORKERS = 1                       # threads processing the alerts in the background. Each account is always served by the same thread: its alerts are processed one at a time and in the order they arrived
+ALERT_QUEUE_SIZE = 1000                 # alerts waiting to be processed before the webhook starts rejecting them
+USE_ASYNCIO = False                     # make independent exchange requests at once using ccxt.async_support
+BATCH_ORDERS = False                    # send the orders of different symbols in one request (create_orders) when the exchange supports it
+BATCH_ORDERS_MAX = 5                    # orders in each batch request. Some exchanges don't take more than 5
+USE_ORDER_STREAMS = False               # get the orders updates pushed from the exchange websocket instead of polling them
+ORDER_POLL_FALLBACK = 3.0               # with orders streams, seconds between polls of an active order to catch missed updates
+PRICE_CACHE_TTL = 1.0                   # seconds the bid/ask prices are reused. 0 disables it
+LEVERAGE_CACHE_TTL = 30 * 60            # seconds the fetched leverage info of a symbol is reused. Our own leverage changes drop it. 0 disables it
+BALANCE_CACHE_TTL = 5.0                 # seconds the balance is reused while no orders are placed, filled or cancelled. 0 disables it
 MARGIN_MODE_NONE = '------'
 FLOAT_ERROR = 1e-9
+ORDERBOOK_TOP_LIMIT = 5                 # order book levels downloaded when we only need the best bid and ask
+ORDERBOOK_TOP_LIMITS = { 'kucoinfutures': 20 }   # exchanges which don't take the default limit
+BATCH_ORDERS_UNSUPPORTED = ( 'bitget', )   # their batches must share a symbol. Ours never have two orders of the same symbol
+BATCH_ORDERS_ERROR_KEYS = ( 'sCode', 'code', 'errorCode', 'retCode' )   # where the exchanges leave the error of a rejected order in a batch
+BATCH_ORDERS_SUCCESS_CODES = ( '', '0', '200', '200000' )
 
 #### Open config file #####
 
@@ -58,6 +95,9 @@ def writeConfig():
         configString += '\t\t"ALERT_TIMEOUT":'+str(ALERT_TIMEOUT)+',\n'
         configString += '\t\t"ORDER_TIMEOUT":'+str(ORDER_TIMEOUT)+',\n'
         configString += '\t\t"REFRESH_POSITIONS_FREQUENCY":'+str(REFRESH_POSITIONS_FREQUENCY)+',\n'
+        configString += '\t\t"DASHBOARD_MAX_STALENESS":'+str(DASHBOARD_MAX_STALENESS)+',\n'
+        configString += '\t\t"ACCOUNT_REPORT_TIMEOUT":'+str(ACCOUNT_REPORT_TIMEOUT)+',\n'
+        configString += '\t\t"API_STATS_LOG_FREQUENCY":'+str(API_STATS_LOG_FREQUENCY)+',\n'
         configString += '\t\t"UPDATE_ORDERS_FREQUENCY":'+str(UPDATE_ORDERS_FREQUENCY)+',\n'
         configString += '\t\t"VERBOSE":'+str(verbose).lower()+',\n'
         configString += '\t\t"SHOW_BALANCE":'+str(SHOW_BALANCE).lower()+',\n'
@@ -66,6 +106,26 @@ def writeConfig():
         configString += '\t\t"SHOW_LIQUIDATION":'+str(SHOW_LIQUIDATION).lower()+',\n'
         configString += '\t\t"SHOW_BREAKEVEN":'+str(SHOW_BREAKEVEN).lower()+',\n'
         configString += '\t\t"LOGS_DIRECTORY":"'+str(LOGS_DIRECTORY)+'",\n'
+        configString += '\t\t"LOG_JSON":'+str(LOG_JSON).lower()+',\n'
+        configString += '\t\t"LOG_MAX_BYTES":'+str(LOG_MAX_BYTES)+',\n'
+        configString += '\t\t"LOG_ROTATE_WHEN":"'+str(LOG_ROTATE_WHEN)+'",\n'
+        configString += '\t\t"LOG_BACKUP_COUNT":'+str(LOG_BACKUP_COUNT)+',\n'
+        configString += '\t\t"CACHE_DIRECTORY":"'+str(CACHE_DIRECTORY)+'",\n'
+        configString += '\t\t"MARKETS_CACHE_TTL":'+str(MARKETS_CACHE_TTL)+',\n'
+        configString += '\t\t"LOCAL_STATE_TTL":'+str(LOCAL_STATE_TTL)+',\n'
+        configString += '\t\t"INIT_THREADS":'+str(INIT_THREADS)+',\n'
+        configString += '\t\t"INIT_TIMEOUT":'+str(INIT_TIMEOUT)+',\n'
+        configString += '\t\t"ASYNC_ALERTS":'+str(ASYNC_ALERTS).lower()+',\n'
+        configString += '\t\t"ALERT_WORKERS":'+str(ALERT_WORKERS)+',\n'
+        configString += '\t\t"ALERT_QUEUE_SIZE":'+str(ALERT_QUEUE_SIZE)+',\n'
+        configString += '\t\t"USE_ASYNCIO":'+str(USE_ASYNCIO).lower()+',\n'
+        configString += '\t\t"BATCH_ORDERS":'+str(BATCH_ORDERS).lower()+',\n'
+        configString += '\t\t"BATCH_ORDERS_MAX":'+str(BATCH_ORDERS_MAX)+',\n'
+        configString += '\t\t"USE_ORDER_STREAMS":'+str(USE_ORDER_STREAMS).lower()+',\n'
+        configString += '\t\t"ORDER_POLL_FALLBACK":'+str(ORDER_POLL_FALLBACK)+',\n'
+        configString += '\t\t"PRICE_CACHE_TTL":'+str(PRICE_CACHE_TTL)+',\n'
+        configString += '\t\t"BALANCE_CACHE_TTL":'+str(BALANCE_CACHE_TTL)+',\n'
+        configString += '\t\t"LEVERAGE_CACHE_TTL":'+str(LEVERAGE_CACHE_TTL)+',\n'
         configString += '\t\t"USE_PROXY":'+str(USE_PROXY).lower()+',\n'
         configString += '\t\t"PROXY_PORT":'+str(PROXY_PORT)+'\n'
         configString += '\t}\n]'
@@ -89,6 +149,12 @@ else:
         ORDER_TIMEOUT = int(config.get('ORDER_TIMEOUT'))
     if( config.get('REFRESH_POSITIONS_FREQUENCY') != None ):
         REFRESH_POSITIONS_FREQUENCY = int(config.get('REFRESH_POSITIONS_FREQUENCY'))
+    if( config.get('DASHBOARD_MAX_STALENESS') != None ):
+        DASHBOARD_MAX_STALENESS = int(config.get('DASHBOARD_MAX_STALENESS'))
+    if( config.get('ACCOUNT_REPORT_TIMEOUT') != None ):
+        ACCOUNT_REPORT_TIMEOUT = float(config.get('ACCOUNT_REPORT_TIMEOUT'))
+    if( config.get('API_STATS_LOG_FREQUENCY') != None ):
+        API_STATS_LOG_FREQUENCY = int(config.get('API_STATS_LOG_FREQUENCY'))
     if( config.get('UPDATE_ORDERS_FREQUENCY') != None ):
         UPDATE_ORDERS_FREQUENCY = float(config.get('UPDATE_ORDERS_FREQUENCY'))
     if( config.get('SHOW_BALANCE') != None ):
@@ -105,6 +171,46 @@ else:
         verbose = bool(config.get('VERBOSE'))
     if( config.get('LOGS_DIRECTORY') != None ):
         LOGS_DIRECTORY = str(config.get('LOGS_DIRECTORY'))
+    if( config.get('LOG_JSON') != None ):
+        LOG_JSON = bool(config.get('LOG_JSON'))
+    if( config.get('LOG_MAX_BYTES') != None ):
+        LOG_MAX_BYTES = int(config.get('LOG_MAX_BYTES'))
+    if( config.get('LOG_ROTATE_WHEN') != None ):
+        LOG_ROTATE_WHEN = str(config.get('LOG_ROTATE_WHEN'))
+    if( config.get('LOG_BACKUP_COUNT') != None ):
+        LOG_BACKUP_COUNT = int(config.get('LOG_BACKUP_COUNT'))
+    if( config.get('CACHE_DIRECTORY') != None ):
+        CACHE_DIRECTORY = str(config.get('CACHE_DIRECTORY'))
+    if( config.get('MARKETS_CACHE_TTL') != None ):
+        MARKETS_CACHE_TTL = int(config.get('MARKETS_CACHE_TTL'))
+    if( config.get('LOCAL_STATE_TTL') != None ):
+        LOCAL_STATE_TTL = int(config.get('LOCAL_STATE_TTL'))
+    if( config.get('INIT_THREADS') != None ):
+        INIT_THREADS = int(config.get('INIT_THREADS'))
+    if( config.get('INIT_TIMEOUT') != None ):
+        INIT_TIMEOUT = int(config.get('INIT_TIMEOUT'))
+    if( config.get('ASYNC_ALERTS') != None ):
+        ASYNC_ALERTS = bool(config.get('ASYNC_ALERTS'))
+    if( config.get('ALERT_WORKERS') != None ):
+        ALERT_WORKERS = int(config.get('ALERT_WORKERS'))
+    if( config.get('ALERT_QUEUE_SIZE') != None ):
+        ALERT_QUEUE_SIZE = int(config.get('ALERT_QUEUE_SIZE'))
+    if( config.get('USE_ASYNCIO') != None ):
+        USE_ASYNCIO = bool(config.get('USE_ASYNCIO'))
+    if( config.get('BATCH_ORDERS') != None ):
+        BATCH_ORDERS = bool(config.get('BATCH_ORDERS'))
+    if( config.get('BATCH_ORDERS_MAX') != None ):
+        BATCH_ORDERS_MAX = max( int(config.get('BATCH_ORDERS_MAX')), 1 )
+    if( config.get('USE_ORDER_STREAMS') != None ):
+        USE_ORDER_STREAMS = bool(config.get('USE_ORDER_STREAMS'))
+    if( config.get('ORDER_POLL_FALLBACK') != None ):
+        ORDER_POLL_FALLBACK = float(config.get('ORDER_POLL_FALLBACK'))
+    if( config.get('PRICE_CACHE_TTL') != None ):
+        PRICE_CACHE_TTL = float(config.get('PRICE_CACHE_TTL'))
+    if( config.get('BALANCE_CACHE_TTL') != None ):
+        BALANCE_CACHE_TTL = float(config.get('BALANCE_CACHE_TTL'))
+    if( config.get('LEVERAGE_CACHE_TTL') != None ):
+        LEVERAGE_CACHE_TTL = float(config.get('LEVERAGE_CACHE_TTL'))
     if( config.get('USE_PROXY') != None ):
         USE_PROXY = bool(config.get('USE_PROXY'))
     if( config.get('PROXY_PORT') != None ):
@@ -141,6 +247,209 @@ class RepeatTimer(Timer):
         while not self.finished.wait(self.interval):
             self.function(*self.args, **self.kwargs)
 
+class durationStats_c:
+    def __init__(self, size = 1000) -> None:
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.last = 0.0
+        self.recent = deque( maxlen = size )
+    def add(self, duration):
+        self.count += 1
+        self.total += duration
+        self.last = duration
+        if( duration > self.max ):
+            self.max = duration
+        self.recent.append( duration )
+    def average(self)->float:
+        return self.total / self.count if self.count > 0 else 0.0
+    def percentile(self, p)->float:
+        # percentile of the recent values
+        values = sorted( self.recent )
+        if( len(values) == 0 ):
+            return 0.0
+        return values[ min( int( len(values) * p / 100.0 ), len(values) - 1 ) ]
+
+LATENCY_BUCKETS = ( 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0 )
+
+class histogram_c:
+    # cumulative buckets for the metrics endpoint. Only written from the account's own thread so it takes no lock
+    def __init__(self, buckets = LATENCY_BUCKETS) -> None:
+        self.buckets = buckets
+        self.counts = [0] * ( len(buckets) + 1 ) # the last one is +Inf
+        self.count = 0
+        self.total = 0.0
+    def observe(self, value):
+        self.counts[ bisect.bisect_left( self.buckets, value ) ] += 1
+        self.count += 1
+        self.total += value
+
+class apiCallStats_c:
+    def __init__(self) -> None:
+        self.latency = durationStats_c( 500 )
+        self.errors = {}    # exception class name: count
+        self.bytes = 0      # size of the responses
+    def add(self, duration, exchange, error = None):
+        self.latency.add( duration )
+        if( error != None ):
+            name = type(error).__name__
+            self.errors[name] = self.errors.get( name, 0 ) + 1
+            return
+        response = getattr( exchange, 'last_http_response', None )
+        if( isinstance( response, str ) ):
+            self.bytes += len( response )
+
+# the exchange methods we time. load_markets is timed where we ask for the markets (ccxt calls it inside most methods)
+EXCHANGE_API_METHODS = ( 'fetch_balance', 'fetch_ticker', 'fetch_order_book', 'fetch_positions', 'fetch_position',
+                        'fetch_leverage', 'set_leverage', 'set_margin_mode', 'set_position_mode', 'create_order', 'create_orders',
+                        'fetch_order', 'fetch_open_orders', 'fetch_closed_orders', 'cancel_order', 'cancel_all_orders' )
+
+def instrumentExchange( exchange, stats: dict ):
+    # replace the API methods of this exchange instance with timed versions.
+    # stats collects an apiCallStats_c for each method. The exchange class is left untouched
+    for name in EXCHANGE_API_METHODS:
+        method = getattr( exchange, name, None )
+        if( method == None ):
+            continue
+        callStats = stats.get( name )
+        if( callStats == None ):
+            callStats = stats[name] = apiCallStats_c()
+        if( asyncio.iscoroutinefunction( method ) ):
+            setattr( exchange, name, timedCoroutine( exchange, method, callStats ) )
+        else:
+            setattr( exchange, name, timedMethod( exchange, method, callStats ) )
+
+def timedMethod( exchange, method, callStats: apiCallStats_c ):
+    def timed( *args, **kwargs ):
+        start = time.monotonic()
+        try:
+            result = method( *args, **kwargs )
+        except Exception as e:
+            callStats.add( time.monotonic() - start, exchange, e )
+            raise
+        callStats.add( time.monotonic() - start, exchange )
+        return result
+    return timed
+
+def timedCoroutine( exchange, method, callStats: apiCallStats_c ):
+    async def timed( *args, **kwargs ):
+        start = time.monotonic()
+        try:
+            result = await method( *args, **kwargs )
+        except Exception as e:
+            callStats.add( time.monotonic() - start, exchange, e )
+            raise
+        callStats.add( time.monotonic() - start, exchange )
+        return result
+    return timed
+
+class asyncRuntime_c:
+    # asyncio event loop running in its own thread. Blocking code hands it coroutines and waits for the results
+    def __init__(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self.thread = Thread( target = self.loop.run_forever, name = 'asyncio', daemon = True )
+        self.thread.start()
+    def run(self, coroutine, timeout = None):
+        return asyncio.run_coroutine_threadsafe( coroutine, self.loop ).result( timeout )
+    def gather(self, *coroutines, timeout = None)->list:
+        async def gatherAll():
+            return await asyncio.gather( *coroutines, return_exceptions = True )
+        return self.run( gatherAll(), timeout )
+    def stop(self):
+        self.loop.call_soon_threadsafe( self.loop.stop )
+
+class orderStream_c:
+    # consumes the private orders stream of an exchange and keeps the last update received for each order.
+    # The exchange can be a ccxt.pro exchange or anything with the coroutines watch_orders() and close()
+    def __init__(self, exchange, name) -> None:
+        self.exchange = exchange
+        self.name = name
+        self.updates = {}   # order id: ( timestamp, order )
+        self.failures = 0
+        self.received = 0
+        self.future = asyncio.run_coroutine_threadsafe( self.run(), getAsyncRuntime().loop )
+    async def run(self):
+        while True:
+            try:
+                orders = await self.exchange.watch_orders()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.failures += 1
+                print( timeNow(), '['+ self.name +'] * E: orders stream:', e, type(e) )
+                await asyncio.sleep( min( self.failures, 30 ) )
+                continue
+            self.failures = 0
+            now = time.monotonic()
+            for order in orders:
+                if( order.get('id') != None ):
+                    self.updates[order['id']] = ( now, order )
+                    self.received += 1
+            if( len(self.updates) > 1000 ): # forget the updates of orders which aren't ours
+                for id, update in list(self.updates.items()):
+                    if( update[0] + ORDER_TIMEOUT * 2 < now ):
+                        self.updates.pop( id, None )
+    def getUpdate(self, id):
+        update = self.updates.get( id )
+        return update[1] if update != None else None
+    def forget(self, id):
+        self.updates.pop( id, None )
+    def connected(self)->bool:
+        return self.failures == 0 and not self.future.done()
+    def stop(self):
+        self.future.cancel()
+        getAsyncRuntime().gather( self.exchange.close() )
+
+asyncRuntime = None
+asyncRuntimeLock = RLock()
+
+def getAsyncRuntime()->asyncRuntime_c:
+    global asyncRuntime
+    with asyncRuntimeLock:
+        if( asyncRuntime == None ):
+            asyncRuntime = asyncRuntime_c()
+    return asyncRuntime
+
+class jsonLogFormatter_c( logging.Formatter ):
+    def format(self, record):
+        return json.dumps( { 'time': record.created,
+                            'monotonic': getattr( record, 'monotonic', None ),
+                            'account': getattr( record, 'account', None ),
+                            'exchange': getattr( record, 'exchange', None ),
+                            'symbol': getattr( record, 'symbol', None ),
+                            'level': record.levelname,
+                            'message': record.getMessage() } )
+
+# the log files are written by a single background thread so the disk never stalls the orders
+logQueue = queue.Queue()
+logListener = logging.handlers.QueueListener( logQueue, respect_handler_level = True )
+logListener.start()
+logHandlersLock = RLock()
+
+def addLogFile( loggerName, path ):
+    if( LOG_MAX_BYTES > 0 ):
+        handler = logging.handlers.RotatingFileHandler( path, maxBytes = LOG_MAX_BYTES, backupCount = LOG_BACKUP_COUNT, encoding = 'utf-8' )
+    elif( LOG_ROTATE_WHEN != '' ):
+        handler = logging.handlers.TimedRotatingFileHandler( path, when = LOG_ROTATE_WHEN, backupCount = LOG_BACKUP_COUNT, encoding = 'utf-8' )
+    else:
+        handler = logging.FileHandler( path, encoding = 'utf-8' )
+
+    if LOG_JSON:
+        handler.setFormatter( jsonLogFormatter_c() )
+    else:
+        handler.setFormatter( logging.Formatter( '[%(asctime)s] %(message)s', '%Y/%m/%d][%H:%M:%S' ) )
+    # the listener offers every record to every file. logging.Filter would also pass the records of "name.other"
+    handler.addFilter( lambda record: record.name == loggerName )
+
+    with logHandlersLock:
+        logListener.handlers = logListener.handlers + ( handler, )
+
+    logger = logging.getLogger( loggerName )
+    logger.addHandler( logging.handlers.QueueHandler( logQueue ) )
+    logger.propagate = False
+    logger.level = logging.INFO
+    return logger
+
 class position_c:
     def __init__(self, symbol, position, thisMarket = None ) -> None:
         self.symbol = symbol
@@ -417,6 +726,9 @@ class order_c:
         self.id = ""
         self.delay = delay
         self.timestamp = time.monotonic()
+        self.lastPoll = self.timestamp
+        self.alertTimestamp = None  # when the alert which created the order was received
+        self.submitTimestamp = None
     def timedOut(self):
         return ( self.timestamp + ORDER_TIMEOUT < time.monotonic() )
     def delayed(self):
@@ -426,10 +738,37 @@ class account_c:
     def __init__(self, exchange = None, name = 'default', apiKey = None, secret = None, password = None, marginMode = None, hedgedMode = False, settleCoin = None )->None:
         
         self.accountName = name
+        self.lock = RLock() # alerts and the orders queue can't be processed at once
+        self.ordersTickStats = durationStats_c() # duration of the orders worker frames
+        self.submitLatency = histogram_c()  # alert received -> order accepted by the exchange
+        self.fillLatency = histogram_c()    # order accepted -> order filled
+        self.orderRetries = 0
+        self.orderTimeouts = 0
+        self.refreshPositionsFailures = 0
+        self.alertTimestamp = None  # timestamp of the alert being processed
+        self.asyncExchange = None
+        self.twinsLock = RLock()    # the markets reload in the background while the async twins are created
+        self.batchOrders = True     # cleared when the exchange refuses our create_orders batches
+        self.orderStream = None
+        self.topOfBook = {}     # symbol: ( timestamp, bid, ask )
+        self.balanceSnapshot = None # ( timestamp, balance )
+        self.localStateTimes = {}   # symbol: { key: timestamp } of the local market data we know about
+        self.localStateDirty = False
+        self.restoredLeverage = set() # symbols which leverage was restored from disk and not confirmed yet
+        self.leverageCache = {}     # symbol: ( timestamp, fetch_leverage response )
+        self.tickerHasPrices = True
+        self.priceCacheHits = 0
+        self.priceCacheMisses = 0
+        self.exchangeName = exchange.lower() if isinstance( exchange, str ) else getattr( exchange, 'id', None )
         self.refreshPositionsFailed = 0
         self.positionslist = []
+        self.positionsTimestamp = 0.0  # time the positions list was last brought up to date
+        self.reportFuture = None       # refresh requested by the JSON report. Still running if the exchange is slow
+        self.touchedSymbols = set()    # symbols with orders placed since their positions were refreshed
         self.ordersQueue = []
         self.activeOrders = []
+        self.queuedSymbols = {}     # symbol: number of orders in the queue
+        self.activeSymbols = {}     # symbol: number of active orders
         self.latchedAlerts = []
         self.MARGIN_MODE = 'cross' if ( marginMode != None and marginMode.lower() == 'cross') else 'isolated'
         self.POSITION_MODE = 'hedged' if hedgedMode else 'oneway'
@@ -443,11 +782,11 @@ class account_c:
         if( name.lower() == 'allaccounts' ):
             print( " * FATAL ERROR: Account 'id' can not be 'allaccounts'" )
             raise ValueError('Invalid Account Name: "allaccounts" is a reserved name.')
-        if( name.lower() == 'allaccounts' ):
-            print( " * FATAL ERROR: Account 'id' can not be 'allaccounts'" )
-            raise ValueError('Invalid Account Name: "allaccounts" is a reserved name.')
         
-        if( exchange.lower() == 'kucoinfutures' ):
+        if( not isinstance( exchange, str ) ):
+            # we were given the exchange object already made (a ccxt exchange or something that behaves like one)
+            self.exchange = exchange
+        elif( exchange.lower() == 'kucoinfutures' ):
             self.exchange = ccxt.kucoinfutures( {
                 'apiKey': apiKey,
                 'secret': secret,
@@ -592,6 +931,9 @@ class account_c:
 
         if( self.exchange == None ):
             raise ValueError('Exchange creation failed')
+
+        self.apiStats = {}  # exchange method: apiCallStats_c
+        instrumentExchange( self.exchange, self.apiStats )
         
         # crate a logger for each account
 
@@ -601,20 +943,43 @@ class account_c:
         else:
             path = f'{LOGS_DIRECTORY}/{self.accountName}.log'
             script_dir = os.path.dirname(os.path.realpath(__file__))
-            if not os.path.exists(os.path.join(script_dir, LOGS_DIRECTORY)):
-                os.makedirs(os.path.join(script_dir, LOGS_DIRECTORY))
+            os.makedirs(os.path.join(script_dir, LOGS_DIRECTORY), exist_ok=True) # the accounts are initialized at once
+
+
+        self.logger = addLogFile( self.accountName, path )
+
+        self.loadMarkets()
+        self.loadLocalState()
+
+        if USE_ASYNCIO:
+            self.createAsyncExchange()
+        if USE_ORDER_STREAMS:
+            self.startOrderStream()
+
+        if self.exchange.has.get('setPositionMode') != True and self.POSITION_MODE != 'oneway':
+            print( f"{self.exchange.id} doesn't support changing position mode. It will remain unchanged.")
+
+        if( verbose ):
+            pprint( self.markets['BTC/' + self.SETTLE_COIN + ':' + self.SETTLE_COIN] )
+            
+        self.refreshPositions(True)
 
 
-        self.logger = logging.getLogger( self.accountName )
-        fh = logging.FileHandler( path )
-        self.logger.addHandler( fh )
-        self.logger.level = logging.INFO
 
+    ## methods ##
+
+    def print( self, *args, sep=" ", symbol = None, **kwargs ): # adds account and exchange information to the message
+        message = sep.join(map(str,args))
+        print( timeNow(), '['+ self.accountName +'/'+ self.exchange.id +'] '+ message, **kwargs )
+        # the date is added by the log writer
+        if( self.logger.isEnabledFor( logging.INFO ) ):
+            self.logger.info( message, extra = { 'monotonic':time.monotonic(), 'account':self.accountName, 'exchange':self.exchange.id, 'symbol':symbol } )
+
+    def buildMarkets( self, markets )->dict:
         # Some exchanges don't have all fields properly filled, but we can find out
         # the values in another field. Instead of adding exceptions at each other function
         # let's reconstruct the markets dictionary trying to fix those values
-        self.markets = {}
-        markets = self.exchange.load_markets()
+        newMarkets = {}
         marketKeys = markets.keys()
         for key in marketKeys:
             thisMarket = markets[key]
@@ -660,29 +1025,271 @@ class account_c:
             if( self.exchange.id == 'bingx' ):
                 thisMarket['limits']['leverage']['max'] = None if self.exchange.has['fetchLeverage'] else max( 100, thisMarket['limits']['leverage']['max'] )
 
-            # also generate a local list to keep track of marginMode and Leverage status
+            # Store the market into the local markets dictionary
+            newMarkets[key] = thisMarket
+
+        return newMarkets
+
+
+    def addLocalMarketsData( self, markets ):
+        # generate a local list to keep track of marginMode and Leverage status.
+        # When replacing the markets keep the status we already knew about
+        for key in markets:
+            thisMarket = markets[key]
+            if( self.markets.get(key) != None and self.markets[key].get('local') != None ):
+                thisMarket['local'] = self.markets[key]['local']
+                continue
             thisMarket['local'] = { 'marginMode':MARGIN_MODE_NONE, 'leverage':0, 'positionMode':'' }
             if( self.exchange.has.get('setPositionMode') != True ):
                 thisMarket['local']['positionMode'] = 'oneway'
 
-            # Store the market into the local markets dictionary
-            self.markets[key] = thisMarket
 
-        if self.exchange.has.get('setPositionMode') != True and self.POSITION_MODE != 'oneway':
-            print( f"{self.exchange.id} doesn't support changing position mode. It will remain unchanged.")
+    def marketsCachePath( self )->str:
+        filename = f'markets_{self.exchangeName}_{self.SETTLE_COIN}.json'
+        if( CACHE_DIRECTORY == '' ):
+            return filename
+        return f'{CACHE_DIRECTORY}/{filename}'
 
-        if( verbose ):
-            pprint( self.markets['BTC/' + self.SETTLE_COIN + ':' + self.SETTLE_COIN] )
-            
-        self.refreshPositions(True)
+
+    def loadMarketsCache( self )->dict:
+        # returns the cached markets dictionary or None when it's missing, outdated or expired
+        try:
+            with open( self.marketsCachePath(), 'r' ) as f:
+                cache = json.load( f )
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            print( timeNow(), " * W: Couldn't read markets cache:", e, type(e) )
+            return None
+
+        if( cache.get('version') != MARKETS_CACHE_VERSION or cache.get('ccxt') != CCXTversion ):
+            return None
+        if( cache.get('timestamp', 0) + MARKETS_CACHE_TTL < time.time() ):
+            return None
+        return cache.get('markets')
 
 
+    def saveMarketsCache( self, markets ):
+        if( CACHE_DIRECTORY != '' and not os.path.exists(CACHE_DIRECTORY) ):
+            os.makedirs( CACHE_DIRECTORY, exist_ok=True )
+
+        # don't store our local status. It's not market information
+        cacheMarkets = {}
+        for key in markets:
+            cacheMarkets[key] = { k: v for k, v in markets[key].items() if k != 'local' }
+
+        cache = { 'version':MARKETS_CACHE_VERSION, 'ccxt':CCXTversion, 'timestamp':time.time(), 'markets':cacheMarkets }
+        path = self.marketsCachePath()
+        tmpPath = f'{path}.{self.accountName}.tmp' # several accounts can share the same cache file
+        try:
+            with open( tmpPath, 'w' ) as f:
+                json.dump( cache, f, default=str )
+            os.replace( tmpPath, path )
+        except Exception as e:
+            print( timeNow(), " * W: Couldn't write markets cache:", e, type(e) )
+
+
+    def localStatePath( self )->str:
+        filename = f'local_{self.accountName}.json'
+        if( CACHE_DIRECTORY == '' ):
+            return filename
+        return f'{CACHE_DIRECTORY}/{filename}'
+
+
+    def setLocalState( self, symbol, key, value ):
+        # every change of the local market data goes through here so it can be saved to disk
+        self.markets[ symbol ]['local'][ key ] = value
+        times = self.localStateTimes.get( symbol )
+        if( times == None ):
+            times = self.localStateTimes[ symbol ] = {}
+        times[ key ] = time.time()
+        if( key == 'leverage' ):
+            self.restoredLeverage.discard( symbol )
+        self.localStateDirty = True
+
+
+    def loadLocalState( self ):
+        # restore the leverage, marginMode and positionMode we knew about before the last restart.
+        # refreshPositions corrects them for the symbols with open positions
+        if( LOCAL_STATE_TTL <= 0 ):
+            return
+        try:
+            with open( self.localStatePath(), 'r' ) as f:
+                state = json.load( f )
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            self.print( " * W: Couldn't read the local markets state:", e, type(e) )
+            return
+
+        if( state.get('exchange') != self.exchangeName or state.get('settle') != self.SETTLE_COIN ):
+            return
+
+        oldest = time.time() - LOCAL_STATE_TTL
+        restored = 0
+        for symbol, entries in state.get('symbols', {}).items():
+            if( self.markets.get(symbol) == None ):
+                continue
+            for key, entry in entries.items():
+                value, timestamp = entry
+                if( timestamp < oldest ):
+                    continue
+                self.markets[ symbol ]['local'][ key ] = value
+                self.localStateTimes.setdefault( symbol, {} )[ key ] = timestamp
+                if( key == 'leverage' ):
+                    self.restoredLeverage.add( symbol )
+                restored += 1
+
+        if( restored > 0 and verbose ):
+            self.print( ' * Restored', restored, 'local markets values' )
+
+
+    def saveLocalState( self ):
+        if( not self.localStateDirty or LOCAL_STATE_TTL <= 0 ):
+            return
+        self.localStateDirty = False
+
+        if( CACHE_DIRECTORY != '' and not os.path.exists(CACHE_DIRECTORY) ):
+            os.makedirs( CACHE_DIRECTORY, exist_ok=True )
+
+        symbols = {}
+        for symbol, times in self.localStateTimes.items():
+            market = self.markets.get( symbol )
+            if( market == None ):
+                continue
+            symbols[ symbol ] = { key: [ market['local'].get(key), timestamp ] for key, timestamp in times.items() }
+
+        state = { 'exchange':self.exchangeName, 'settle':self.SETTLE_COIN, 'symbols':symbols }
+        path = self.localStatePath()
+        tmpPath = f'{path}.tmp'
+        try:
+            with open( tmpPath, 'w' ) as f:
+                json.dump( state, f )
+            os.replace( tmpPath, path )
+        except Exception as e:
+            self.print( " * W: Couldn't write the local markets state:", e, type(e) )
+
+
+    def loadMarkets( self ):
+        self.markets = {}
+
+        markets = self.loadMarketsCache()
+        if( markets != None ):
+            # give the exchange the markets so it doesn't need to load them
+            self.exchange.set_markets( markets )
+            if( self.exchange.options.get('adjustForTimeDifference') ):
+                self.exchange.load_time_difference()
+            self.addLocalMarketsData( markets )
+            self.buildSymbolIndex( markets )
+            self.markets = markets
+
+            # and get the fresh ones in the background
+            thread = Thread( target = self.refreshMarkets, daemon = True )
+            thread.start()
+            return
+
+        markets = self.buildMarkets( self.downloadMarkets() )
+        self.addLocalMarketsData( markets )
+        self.buildSymbolIndex( markets )
+        self.markets = markets
+        self.saveMarketsCache( markets )
+
+
+    def downloadMarkets( self, reload = False )->dict:
+        callStats = self.apiStats.get( 'load_markets' )
+        if( callStats == None ):
+            callStats = self.apiStats['load_markets'] = apiCallStats_c()
+        return timedMethod( self.exchange, self.exchange.load_markets, callStats )( reload )
+
+
+    def refreshMarkets( self ):
+        try:
+            markets = self.buildMarkets( self.downloadMarkets( True ) )
+        except Exception as e:
+            self.print( " * W: refreshMarkets: Couldn't reload markets. Using cached markets:", e, type(e) )
+            return
+        self.addLocalMarketsData( markets )
+        self.buildSymbolIndex( markets )
+        self.markets = markets
+        self.saveMarketsCache( markets )
+        self.updateTwinsMarkets()
+
+
+    def updateTwinsMarkets( self ):
+        # the async twins took the cached markets when they were created. Give them the fresh ones.
+        # Twins created after the reload already copied the fresh markets from our exchange
+        with self.twinsLock:
+            twins = [ self.asyncExchange ]
+            if( self.orderStream != None ):
+                twins.append( self.orderStream.exchange )
+            for twin in twins:
+                if( twin == None or not hasattr( twin, 'set_markets' ) ):
+                    continue
+                async def setMarkets( twin ):
+                    twin.set_markets( self.exchange.markets, self.exchange.currencies )
+                getAsyncRuntime().run( setMarkets( twin ) )
+
+
+    def createAsyncExchange( self ):
+        # create a ccxt.async_support twin of our exchange so independent requests can be made at once
+        import ccxt.async_support
+        with self.twinsLock:
+            self.asyncExchange = self.createExchangeTwin( ccxt.async_support )
+        instrumentExchange( self.asyncExchange, self.apiStats )
+
+
+    def createExchangeTwin( self, module ):
+        # create an exchange like ours from the async ccxt modules (ccxt.async_support or ccxt.pro)
+        exchangeClass = getattr( module, type(self.exchange).__name__ )
+        options = {}
+        for key in ( 'defaultType', 'defaultMarginMode', 'adjustForTimeDifference', 'timeDifference' ):
+            if( key in self.exchange.options ):
+                options[key] = self.exchange.options[key]
+
+        async def create():
+            # the exchange must be created inside the event loop
+            exchange = exchangeClass({
+                "apiKey": self.exchange.apiKey,
+                "secret": self.exchange.secret,
+                'password': self.exchange.password,
+                "options": options,
+                "enableRateLimit": self.exchange.enableRateLimit
+                })
+            if( self.exchange.isSandboxModeEnabled ):
+                exchange.set_sandbox_mode( True )
+            if( 'apiBackupDemoTrading' in self.exchange.urls ):
+                exchange.enable_demo_trading( True )
+            exchange.set_markets( self.exchange.markets, self.exchange.currencies )
+            return exchange
+
+        return getAsyncRuntime().run( create() )
 
-    ## methods ##
 
-    def print( self, *args, sep=" ", **kwargs ): # adds account and exchange information to the message
-        print( timeNow(), '['+ self.accountName +'/'+ self.exchange.id +'] '+ sep.join(map(str,args)), **kwargs )
-        self.logger.info( '['+ dateString()+']['+timeNow()+'] ' +sep.join(map(str,args)), **kwargs)
+    def startOrderStream( self, exchange = None ):
+        # exchange: where to watch the orders from instead of a ccxt.pro twin (the benchmarks pass a fake one)
+        with self.twinsLock:
+            self.createOrderStream( exchange )
+
+
+    def createOrderStream( self, exchange ):
+        if( exchange == None ):
+            import ccxt.pro
+            if( not hasattr( ccxt.pro, type(self.exchange).__name__ ) ):
+                self.print( " * W: Orders stream not available for", self.exchange.id, ". Polling orders" )
+                return
+            exchange = self.createExchangeTwin( ccxt.pro )
+            if( exchange.has.get('watchOrders') != True ):
+                self.print( " * W: Orders stream not available for", self.exchange.id, ". Polling orders" )
+                getAsyncRuntime().gather( exchange.close() )
+                return
+        self.orderStream = orderStream_c( exchange, self.accountName )
+
+
+    def asyncGather( self, *coroutines )->list:
+        # run the coroutines at once in the event loop and wait for all of them.
+        # Exceptions are returned in place of the result
+        return getAsyncRuntime().gather( *coroutines )
+
 
     def verifyLeverageRange( self, symbol, leverage )->int:
 
@@ -712,7 +1319,7 @@ class account_c:
             try:
                 response = self.exchange.set_position_mode( False, symbol )
             except ccxt.NoChange as e:
-                self.markets[ symbol ]['local']['positionMode'] = 'oneway'
+                self.setLocalState( symbol, 'positionMode', 'oneway' )
             except Exception as e:
                 for a in e.args:
                     if( '"retCode":140025' in a or '"code":-4059' in a
@@ -722,7 +1329,7 @@ class account_c:
                         # bybit {"retCode":110025,"retMsg":"Position mode is not modified","result":{},"retExtInfo":{},"time":1694988241696}
                         # binance {"code":-4059,"msg":"No need to change position side."}
                         # okx {"code":"59000","data":[],"msg":"Setting failed. Cancel any open orders, close positions, and stop trading bots first."}
-                        self.markets[ symbol ]['local']['positionMode'] = 'oneway'
+                        self.setLocalState( symbol, 'positionMode', 'oneway' )
                     else:
                         print( " * E: updateSymbolLeverage->set_position_mode:", a, type(e) )
             else:
@@ -744,7 +1351,7 @@ class account_c:
                     print( " * E: updateSymbolLeverage->set_position_mode:", response )
                     return
                 
-                self.markets[ symbol ]['local']['positionMode'] = 'oneway'
+                self.setLocalState( symbol, 'positionMode', 'oneway' )
 
     
     def updateSymbolLeverage( self, symbol, leverage ):
@@ -763,6 +1370,7 @@ class account_c:
         ##########################################   
         if( self.markets[ symbol ]['local']['marginMode'] != self.MARGIN_MODE and self.exchange.has.get('setMarginMode') == True ):
 
+            self.invalidateLeverageInfo( symbol )
             params = {}
             # coinex and bybit expect the leverage as part of the marginMode call
             if( self.exchange.id == 'coinex' or self.exchange.id == 'bybit' ):
@@ -774,9 +1382,9 @@ class account_c:
                 response = self.exchange.set_margin_mode( self.MARGIN_MODE, symbol, params )
 
             except ccxt.NoChange as e:
-                self.markets[ symbol ]['local']['marginMode'] = self.MARGIN_MODE
+                self.setLocalState( symbol, 'marginMode', self.MARGIN_MODE )
             except ccxt.MarginModeAlreadySet as e:
-                self.markets[ symbol ]['local']['marginMode'] = self.MARGIN_MODE
+                self.setLocalState( symbol, 'marginMode', self.MARGIN_MODE )
             except Exception as e:
                 for a in e.args:
                     if( '"retCode":140026' in a or "No need to change margin type" in a
@@ -787,7 +1395,7 @@ class account_c:
                         # bybit {"retCode":110026,"retMsg":"Cross/isolated margin mode is not modified","result":{},"retExtInfo":{},"time":1695526888984}
                         # binance {'code': -4046, 'msg': 'No need to change margin type.'}
                         # updateSymbolLeverage->set_margin_mode: {'code': -4046, 'msg': 'No need to change margin type.'}
-                        self.markets[ symbol ]['local']['marginMode'] = self.MARGIN_MODE
+                        self.setLocalState( symbol, 'marginMode', self.MARGIN_MODE )
                     if( self.exchange.id == 'bitget' and 'code":"45117' in a):
                         print( " * W: Bitget: Currently holding positions or orders, the margin mode cannot be adjusted" )
                         #self.markets[ symbol ]['local']['marginMode'] = 'cross' if self.MARGIN_MODE == 'isolated' else 'isolated'
@@ -814,11 +1422,11 @@ class account_c:
                 if( code != 0 ):
                     print( " * E: updateSymbolLeverage->set_margin_mode:", response )
                 else:
-                    self.markets[ symbol ]['local']['marginMode'] = self.MARGIN_MODE
+                    self.setLocalState( symbol, 'marginMode', self.MARGIN_MODE )
 
                     # coinex and bybit don't need to continue since they have already updated the leverage
                     if( self.exchange.id == 'coinex' or self.exchange.id == 'bybit' ):
-                        self.markets[ symbol ]['local']['leverage'] = leverage
+                        self.setLocalState( symbol, 'leverage', leverage )
                         return
 
         ##########################################
@@ -829,6 +1437,7 @@ class account_c:
             # from phemex API documentation: The sign of leverageEr indicates margin mode,
             # i.e. leverage <= 0 means cross-margin-mode, leverage > 0 means isolated-margin-mode.
 
+            self.invalidateLeverageInfo( symbol )
             params = {}
             if( self.exchange.id == 'coinex' ): # coinex always updates leverage and marginMode at the same time
                 params['marginMode'] = self.markets[ symbol ]['local']['marginMode'] # use current marginMode to avoid triggering an error
@@ -840,7 +1449,7 @@ class account_c:
                     response = self.exchange.set_leverage( leverage, symbol, params = {'side':'LONG'} )
                     response2 = self.exchange.set_leverage( leverage, symbol, params = {'side':'SHORT'} )
                     if( response.get('code') == '0' and response2.get('code') == '0' ):
-                        self.markets[ symbol ]['local']['leverage'] = leverage
+                        self.setLocalState( symbol, 'leverage', leverage )
                     return
                 else:
                     params['side'] = 'BOTH'
@@ -848,7 +1457,7 @@ class account_c:
             try:
                 response = self.exchange.set_leverage( leverage, symbol, params )
             except ccxt.NoChange as e:
-                self.markets[ symbol ]['local']['leverage'] = leverage
+                self.setLocalState( symbol, 'leverage', leverage )
             except Exception as e:
                 for a in e.args:
                     if( '"retCode":140043' in a or '"retCode":110043' in a ):
@@ -882,17 +1491,18 @@ class account_c:
                 if( code != 0 ):
                     print( " * E: updateSymbolLeverage->set_leverage:", response )
                 else:
-                    self.markets[ symbol ]['local']['leverage'] = leverage
+                    self.setLocalState( symbol, 'leverage', leverage )
 
 
 
-    def fetchBalance(self):
+    def balanceParams(self)->dict:
         params = { "settle":self.SETTLE_COIN }
         if( self.exchange.id == 'krakenfutures' ):
             params['type'] = 'flex'
+        return params
 
-        response = self.exchange.fetch_balance( params )
 
+    def parseBalance(self, response)->dict:
         if( self.exchange.id == 'krakenfutures' ):
             data = response['info']['accounts']['flex']
             return { 'free':float(data.get('availableMargin')), 'used':float(data.get('initialMarginWithOrders')), 'total': float(data.get('balanceValue')) }
@@ -902,32 +1512,137 @@ class account_c:
             return balance
         
         return response.get(self.SETTLE_COIN)
+
+
+    def fetchBalance(self, maxAge = None):
+        # a burst of alerts can use the same balance. The snapshot is dropped when orders are placed, filled or cancelled
+        snapshot = self.balanceSnapshot
+        if( snapshot != None and snapshot[0] + ( BALANCE_CACHE_TTL if maxAge == None else maxAge ) > time.monotonic() ):
+            return snapshot[1]
+
+        balance = self.parseBalance( self.exchange.fetch_balance( self.balanceParams() ) )
+        self.balanceSnapshot = ( time.monotonic(), balance )
+        return balance
+
+
+    async def fetchBalanceAsync(self, maxAge = None):
+        snapshot = self.balanceSnapshot
+        if( snapshot != None and snapshot[0] + ( BALANCE_CACHE_TTL if maxAge == None else maxAge ) > time.monotonic() ):
+            return snapshot[1]
+
+        balance = self.parseBalance( await self.asyncExchange.fetch_balance( self.balanceParams() ) )
+        self.balanceSnapshot = ( time.monotonic(), balance )
+        return balance
+
+
+    def invalidateBalance(self):
+        self.balanceSnapshot = None
     
 
-    def fetchAvailableBalance(self)->float:
-        return float( self.fetchBalance().get( 'free' ) )
+    def fetchAvailableBalance(self, maxAge = None)->float:
+        return float( self.fetchBalance( maxAge ).get( 'free' ) )
     
 
-    def fetchBuyPrice(self, symbol)->float:
-        orderbook = self.exchange.fetch_order_book(symbol)
+    def topOfBookFromOrderBook(self, orderbook)->tuple:
+        bid = orderbook['bids'][0][0] if len (orderbook['bids']) > 0 else None
         ask = orderbook['asks'][0][0] if len (orderbook['asks']) > 0 else None
+        return bid, ask
+
+
+    def topOfBookFromTicker(self, ticker)->tuple:
+        bid = ticker.get('bid')
+        ask = ticker.get('ask')
+        if( bid == None and ask == None ):
+            if( ticker.get('symbol') != None ):
+                self.tickerHasPrices = False
+            return None, None
+        # only one side in the ticker. Use it for both instead of downloading the order book too
+        return ( bid if bid != None else ask ), ( ask if ask != None else bid )
+
+
+    def orderBookLimit(self)->int:
+        # we only want the top of the book. Download the fewest levels the exchange takes
+        return ORDERBOOK_TOP_LIMITS.get( self.exchange.id, ORDERBOOK_TOP_LIMIT )
+
+
+    def storeTopOfBook(self, symbol, bid, ask):
+        self.topOfBook[symbol] = ( time.monotonic(), bid, ask )
+
+
+    def cachedTopOfBook(self, symbol):
+        # the best bid and ask if they were fetched a moment ago, otherwise None
+        cached = self.topOfBook.get( symbol )
+        if( cached != None and cached[0] + PRICE_CACHE_TTL > time.monotonic() ):
+            self.priceCacheHits += 1
+            return cached[1], cached[2]
+        self.priceCacheMisses += 1
+        return None
+
+
+    def fetchTopOfBook(self, symbol)->tuple:
+        # returns the best bid and ask. Any of them can be None.
+        # They're shared for a short time so a single alert doesn't download the prices several times
+        cached = self.cachedTopOfBook( symbol )
+        if( cached != None ):
+            return cached
+
+        # the ticker is lighter than the order book, but not every exchange includes the prices in it
+        bid = ask = None
+        if( self.tickerHasPrices ):
+            try:
+                ticker = self.exchange.fetch_ticker( symbol )
+            except Exception as e:
+                ticker = {}
+            bid, ask = self.topOfBookFromTicker( ticker )
+
+        if( bid == None and ask == None ):
+            bid, ask = self.topOfBookFromOrderBook( self.exchange.fetch_order_book( symbol, self.orderBookLimit() ) )
+
+        self.storeTopOfBook( symbol, bid, ask )
+        return bid, ask
+
+
+    async def fetchTopOfBookAsync(self, symbol)->tuple:
+        # fetchTopOfBook through the async exchange
+        cached = self.cachedTopOfBook( symbol )
+        if( cached != None ):
+            return cached
+
+        bid = ask = None
+        if( self.tickerHasPrices ):
+            try:
+                ticker = await self.asyncExchange.fetch_ticker( symbol )
+            except Exception as e:
+                ticker = {}
+            bid, ask = self.topOfBookFromTicker( ticker )
+
+        if( bid == None and ask == None ):
+            bid, ask = self.topOfBookFromOrderBook( await self.asyncExchange.fetch_order_book( symbol, self.orderBookLimit() ) )
+
+        self.storeTopOfBook( symbol, bid, ask )
+        return bid, ask
+
+
+    def fetchBuyPrice(self, symbol)->float:
+        bid, ask = self.fetchTopOfBook( symbol )
         if( ask == None ):
             raise ValueError( "Couldn't fetch ask price" )
         return ask
 
 
     def fetchSellPrice(self, symbol)->float:
-        orderbook = self.exchange.fetch_order_book(symbol)
-        bid = orderbook['bids'][0][0] if len (orderbook['bids']) > 0 else None
+        bid, ask = self.fetchTopOfBook( symbol )
         if( bid == None ):
             raise ValueError( "Couldn't fetch bid price" )
         return bid
 
 
     def fetchAveragePrice(self, symbol)->float:
-        orderbook = self.exchange.fetch_order_book(symbol)
-        bid = orderbook['bids'][0][0] if len (orderbook['bids']) > 0 else None
-        ask = orderbook['asks'][0][0] if len (orderbook['asks']) > 0 else None
+        bid, ask = self.fetchTopOfBook( symbol )
+        return self.averagePrice( bid, ask )
+
+
+    def averagePrice(self, bid, ask)->float:
         if( bid == None and ask == None ):
             raise ValueError( "Couldn't fetch orderbook" )
         if( bid == None ): bid = ask
@@ -935,6 +1650,29 @@ class account_c:
         return ( bid + ask ) * 0.5
 
 
+    def generateApiStats(self)->dict:
+        report = {}
+        for name, callStats in self.apiStats.items():
+            latency = callStats.latency
+            if( latency.count == 0 ):
+                continue
+            report[name] = { 'calls': latency.count,
+                            'p50': latency.percentile( 50 ),
+                            'p90': latency.percentile( 90 ),
+                            'p99': latency.percentile( 99 ),
+                            'max': latency.max,
+                            'errors': dict( callStats.errors ),
+                            'bytes': callStats.bytes }
+        return report
+
+
+    def logApiStats(self):
+        # summary of the exchange calls for the account log. Not printed to the console
+        for name, entry in sorted( self.generateApiStats().items() ):
+            errors = sum( entry['errors'].values() )
+            self.logger.info( f" API {name}: {entry['calls']} calls. p50 {entry['p50']:.3f}s p90 {entry['p90']:.3f}s p99 {entry['p99']:.3f}s max {entry['max']:.3f}s. {errors} errors" + ( f" {entry['errors']}" if errors else '' ) )
+
+
     def getPositionBySymbol(self, symbol)->position_c:
         for pos in self.positionslist:
             if( pos.symbol == symbol ):
@@ -942,11 +1680,40 @@ class account_c:
         return None
     
 
+    def buildSymbolIndex( self, markets ):
+        # map every accepted spelling of a symbol to the ccxt symbol so the
+        # alert tokens can be resolved with a single lookup
+        index = {}
+        for key in markets:
+            index[markets[key]['symbol']] = markets[key]['symbol']
+        for key in markets:
+            m = markets[key]
+            symbol = m['symbol']
+            index.setdefault( m['id'], symbol )
+            if( symbol == f"{m['base']}/{self.SETTLE_COIN}:{self.SETTLE_COIN}" ):
+                for alias in ( f"{m['base']}{self.SETTLE_COIN}", f"{m['base']}{self.SETTLE_COIN}.P", f"{m['base']}/{self.SETTLE_COIN}" ):
+                    index.setdefault( alias, symbol )
+        for alias in list(index.keys()):
+            index.setdefault( alias.lower(), index[alias] )
+
+        self.symbolIndex = index
+        self.pairNamesCache = {} # also caches the tokens which are not symbols
+        self.alertsCache = {} # parsed alerts depend on the symbols
+
+
     def findSymbolFromPairName(self, pairString):
         # this is only for the pair name we receive in the alert.
         # Once it's converted to ccxt symbol format there is no
         # need to use this method again.
 
+        symbol = self.symbolIndex.get(pairString)
+        if( symbol != None ):
+            return symbol
+
+        pairNamesCache = self.pairNamesCache
+        if( pairString in pairNamesCache ):
+            return pairNamesCache[pairString]
+
         paircmd = pairString.upper()
 
         if( paircmd.endswith('.P' ) ):
@@ -962,18 +1729,11 @@ class account_c:
         if '/' in paircmd and not paircmd.endswith(':'+ self.SETTLE_COIN ):
             paircmd += ':' + self.SETTLE_COIN
 
-        # try the more direct approach
-        m = self.markets.get(paircmd)
-        if( m != None ):
-            return m.get('symbol')
-
-        # so now let's find it in the list using the id
-        for m in self.markets:
-            id = self.markets[m]['id'] 
-            symbol = self.markets[m]['symbol']
-            if( symbol == paircmd or id == paircmd ):
-                return symbol
-        return None
+        symbol = self.symbolIndex.get(paircmd)
+        if( len(pairNamesCache) >= 4096 ): # alerts can carry any kind of token. Don't let it grow forever
+            pairNamesCache.clear()
+        pairNamesCache[pairString] = symbol
+        return symbol
     
 
     def findContractSizeForSymbol(self, symbol)->float:
@@ -992,12 +1752,27 @@ class account_c:
         return self.markets[symbol]['limits']['amount'].get('min')
     
 
+    def fetchLeverageInfo(self, symbol)->dict:
+        # refreshPositions and findMaxLeverageForSymbol share the response. It only changes when we change it
+        cached = self.leverageCache.get( symbol )
+        if( cached != None and cached[0] + LEVERAGE_CACHE_TTL > time.monotonic() ):
+            return cached[1]
+
+        response = self.exchange.fetch_leverage( symbol )
+        self.leverageCache[ symbol ] = ( time.monotonic(), response )
+        return response
+
+
+    def invalidateLeverageInfo(self, symbol):
+        self.leverageCache.pop( symbol, None )
+
+
     def findMaxLeverageForSymbol(self, symbol)->float:
         maxLeverage = self.markets[symbol]['limits']['leverage'].get('max')
         if( maxLeverage == None ):
             maxLeverage = 100
             if( self.exchange.has['fetchLeverage'] ):
-                info = self.exchange.fetch_leverage( symbol ).get('info')
+                info = self.fetchLeverageInfo( symbol ).get('info')
 
                 if( info != None and info.get('maxLongLeverage') != None and info.get('maxShortLeverage') != None ):
                     maxLeverage = min(int(info['maxLongLeverage']), int(info['maxShortLeverage']))
@@ -1015,17 +1790,15 @@ class account_c:
         return roundDownTick( coin, precision ) if ( coin > 0 ) else roundUpTick( coin, precision ) 
 
 
-    def refreshPositions(self, v = verbose):
+    def fetchPositions(self, symbols = None)->list:
     ### https://docs.ccxt.com/#/?id=position-structure ###
+    # returns the list of open positions or None when the request failed
         failed = False
         try:
-            symbols = None
-            if( self.exchange.id == 'bitget' ):
-                symbols = list(self.markets.keys())
             positions = self.exchange.fetch_positions( symbols, params = {'settle':self.SETTLE_COIN} ) # the 'settle' param is only required by phemex
 
         except Exception as e:
-            a = e.args[0]
+            a = str(e)
             if 'OK' in a: # Coinex raises an exception to give an OK message when there are no positions... don't look at me, look at them
                 positions = []
             elif '502 Bad Gateway' in a:
@@ -1045,10 +1818,10 @@ class account_c:
                     
                 if 'code":-2015' in a: # For some reason 'binancedemo' makes it all the way here without a valid API key.
                     print( timeNow(), self.exchange.id, '* E: Refreshpositions:(broken)', a, type(e) )
-                    return
+                    return None
                 elif 'access_id not exists': # and now coinex is doing it too. IDK why they reach here. They didn't before.
                     print( timeNow(), self.exchange.id, "access_id not exists" )
-                    return
+                    return None
                 
             elif( 'Remote end closed connection' in a
                   or '500 Internal Server Error' in a
@@ -1068,9 +1841,10 @@ class account_c:
 
         if( failed ):
             self.refreshPositionsFailed += 1
+            self.refreshPositionsFailures += 1
             if( self.refreshPositionsFailed == 10 ):
                 print( timeNow(), self.exchange.id, '* W: Refreshpositions has failed 10 times in a row' )
-            return
+            return None
         
         if (self.refreshPositionsFailed >= 10 ):
             print( timeNow(), self.exchange.id, '* W: Refreshpositions has returned to activity' )
@@ -1081,193 +1855,363 @@ class account_c:
         # reconstruct the list of positions only with active positions
         cleanPositionsList = []
         for thisPosition in positions:
-            if( abs(thisPosition.get('contracts', 0.0)) < FLOAT_ERROR ):
+            if( thisPosition == None or abs(thisPosition.get('contracts') or 0.0) < FLOAT_ERROR ):
                 continue
             cleanPositionsList.append( thisPosition )
-        positions = cleanPositionsList
+        return cleanPositionsList
 
-        numPositions = len(positions)
 
-        if v:
-            tab = '  '
-            if( numPositions > 0 ) : print('------------------------------')
-            # fetch balance
-            balanceString = ''
-            if SHOW_BALANCE:
-                balance = self.fetchBalance()
-                balanceString = " Balance: {:.2f}[$]".format(balance['total'])
-                balanceString += " - Available {:.2f}[$]".format(balance['free'])
-            print( tab + str(numPositions), "positions found.", balanceString )
+    def refreshPositions(self, v = verbose):
+        symbols = None
+        if( self.exchange.id == 'bitget' ):
+            symbols = list(self.markets.keys())
+        positions = self.fetchPositions( symbols )
+        if( positions == None ):
+            return
 
         newPositionsList = []
         for thisPosition in positions:
+            newPositionsList.append( self.updateLocalFromPosition( thisPosition ) )
+        
+        self.positionslist = newPositionsList
+        self.positionsTimestamp = time.time()
+        self.touchedSymbols.clear()
+        self.saveLocalState()
 
-            symbol = thisPosition.get('symbol')
+        if v:
+            self.printPositions()
 
-            # HACK!! bybit response doesn't contain a 'hedge' key, but it contains the information in the 'info' block
-            if( self.exchange.id == 'bybit' ):
-                thisPosition['hedged'] = True if( thisPosition['info'].get( 'positionIdx' ) != '0' ) else False
 
-            if( self.exchange.id == 'bingx' ): # 'onlyOnePosition': True,
-                thisPosition['hedged'] = not thisPosition['info'].get( 'onlyOnePosition' )
+    def refreshSymbolPositions(self, symbols, v = verbose):
+        # refresh only the positions of these symbols and merge them into the positions list.
+        # The full sweep is left to the refresh timer
+        symbols = set( symbol for symbol in symbols if symbol in self.markets )
+        if( len(symbols) == 0 ):
+            if v:
+                self.printPositions()
+            return
 
-            # if the position contains positionMode information update our local data
-            if( thisPosition.get('hedged') != None ) : # None means the exchange only supports oneWay
-                self.markets[ symbol ]['local'][ 'positionMode' ] = 'hedged' if( thisPosition.get('hedged') == True ) else 'oneway'
+        try:
+            symbol = next(iter(symbols))
+            if( len(symbols) == 1 and self.exchange.has.get('fetchPosition') == True and self.markets[ symbol ]['local']['positionMode'] == 'oneway' ):
+                positions = [ self.exchange.fetch_position( symbol, params = {'settle':self.SETTLE_COIN} ) ]
+            else:
+                positions = self.exchange.fetch_positions( list(symbols), params = {'settle':self.SETTLE_COIN} )
+        except Exception as e:
+            if( 'OK' in str(e) ): # Coinex again
+                positions = []
+            else:
+                # let the full refresh deal with the error
+                self.refreshPositions( v )
+                return
 
+        newPositionsList = [ pos for pos in self.positionslist if pos.symbol not in symbols ]
+        for thisPosition in positions:
+            if( thisPosition == None or abs(thisPosition.get('contracts') or 0.0) < FLOAT_ERROR ):
+                continue
+            if( thisPosition.get('symbol') not in symbols ): # some exchanges ignore the symbols filter
+                continue
+            newPositionsList.append( self.updateLocalFromPosition( thisPosition ) )
 
-            # if the position contains the marginMode information also update the local data
+        self.positionslist = newPositionsList
+        self.touchedSymbols.difference_update( symbols )
+        if( len(self.touchedSymbols) == 0 ):
+            # every symbol we placed orders on is fresh again. The list is as good as a full refresh
+            self.positionsTimestamp = time.time()
+        self.saveLocalState()
 
-            #some exchanges have the key set to None. Fix it when possible
-            if( thisPosition.get('marginMode') == None ) :
-                if( self.exchange.id == 'bybit' ): # tradeMode - Classic & UTA (inverse): 0: cross-margin, 1: isolated margin
-                    self.markets[ symbol ]['local'][ 'marginMode' ] = 'isolated' if thisPosition['info']['tradeMode'] == '1' else 'cross'
-                elif( self.exchange.has.get('setMarginMode') != True ):
-                    thisPosition['marginMode'] = MARGIN_MODE_NONE
-                else:
-                    print( ' * W: refreshPositions: Could not get marginMode for', symbol )
-                    thisPosition['marginMode'] = MARGIN_MODE_NONE
-            else:
-                self.markets[ symbol ]['local'][ 'marginMode' ] = thisPosition.get('marginMode')
+        if v:
+            self.printPositions()
 
-            # update the local leverage as well as we can
-            leverage = -1
-            if( thisPosition.get('leverage') != None ):
-                leverage = int(thisPosition.get('leverage'))
-                if( leverage != thisPosition.get('leverage') ): # kucoin sends weird fractional leverage. Ignore it
-                    leverage = -1
 
-            # still didn't find the leverage, but the exchange has the fetchLeverage method so we can try that.
-            if( leverage == -1 and self.exchange.has.get('fetchLeverage') == True ):
-                try:
-                    response = self.exchange.fetch_leverage( symbol )
-                except Exception as e:
-                    pass
-                else:
-                    if( self.exchange.id == 'bitget' ):
-                        if( response['data']['marginMode'] == 'crossed' ):
-                            leverage = int(response['data'].get('crossMarginLeverage'))
-                        else:
-                            # they should always be the same
-                            longLeverage = int(response['data'].get('fixedLongLeverage'))
-                            shortLeverage = int(response['data'].get('fixedShortLeverage'))
-                            if( longLeverage == shortLeverage ):
-                                leverage = longLeverage
+    def printPositions(self):
+        tab = '  '
+        numPositions = len(self.positionslist)
+        if( numPositions > 0 ) : print('------------------------------')
+        # fetch balance
+        balanceString = ''
+        if SHOW_BALANCE:
+            balance = self.fetchBalance()
+            balanceString = " Balance: {:.2f}[$]".format(balance['total'])
+            balanceString += " - Available {:.2f}[$]".format(balance['free'])
+        print( tab + str(numPositions), "positions found.", balanceString )
 
-                    elif( self.exchange.id == 'bingx' ):
+        for pos in self.positionslist:
+            print( tab + pos.generatePrintString() )
+
+        print('------------------------------')
+
+
+    def updateLocalFromPosition(self, thisPosition)->position_c:
+        symbol = thisPosition.get('symbol')
+
+        # HACK!! bybit response doesn't contain a 'hedge' key, but it contains the information in the 'info' block
+        if( self.exchange.id == 'bybit' ):
+            thisPosition['hedged'] = True if( thisPosition['info'].get( 'positionIdx' ) != '0' ) else False
+
+        if( self.exchange.id == 'bingx' ): # 'onlyOnePosition': True,
+            thisPosition['hedged'] = not thisPosition['info'].get( 'onlyOnePosition' )
+
+        # if the position contains positionMode information update our local data
+        if( thisPosition.get('hedged') != None ) : # None means the exchange only supports oneWay
+            self.setLocalState( symbol, 'positionMode', 'hedged' if( thisPosition.get('hedged') == True ) else 'oneway' )
+
+
+        # if the position contains the marginMode information also update the local data
+
+        #some exchanges have the key set to None. Fix it when possible
+        if( thisPosition.get('marginMode') == None ) :
+            if( self.exchange.id == 'bybit' ): # tradeMode - Classic & UTA (inverse): 0: cross-margin, 1: isolated margin
+                self.setLocalState( symbol, 'marginMode', 'isolated' if thisPosition['info']['tradeMode'] == '1' else 'cross' )
+            elif( self.exchange.has.get('setMarginMode') != True ):
+                thisPosition['marginMode'] = MARGIN_MODE_NONE
+            else:
+                print( ' * W: refreshPositions: Could not get marginMode for', symbol )
+                thisPosition['marginMode'] = MARGIN_MODE_NONE
+        else:
+            self.setLocalState( symbol, 'marginMode', thisPosition.get('marginMode') )
+
+        # update the local leverage as well as we can
+        leverage = -1
+        if( thisPosition.get('leverage') != None ):
+            leverage = int(thisPosition.get('leverage'))
+            if( leverage != thisPosition.get('leverage') ): # kucoin sends weird fractional leverage. Ignore it
+                leverage = -1
+
+        # the leverage we saved before restarting is still good. Don't ask for it again
+        restored = leverage == -1 and symbol in self.restoredLeverage
+        if( restored ):
+            leverage = self.markets[ symbol ]['local'][ 'leverage' ]
+
+        # still didn't find the leverage, but the exchange has the fetchLeverage method so we can try that.
+        if( leverage == -1 and self.exchange.has.get('fetchLeverage') == True ):
+            try:
+                response = self.fetchLeverageInfo( symbol )
+            except Exception as e:
+                pass
+            else:
+                if( self.exchange.id == 'bitget' ):
+                    if( response['data']['marginMode'] == 'crossed' ):
+                        leverage = int(response['data'].get('crossMarginLeverage'))
+                    else:
                         # they should always be the same
-                        longLeverage = response['data'].get('longLeverage')
-                        shortLeverage = response['data'].get('shortLeverage')
+                        longLeverage = int(response['data'].get('fixedLongLeverage'))
+                        shortLeverage = int(response['data'].get('fixedShortLeverage'))
                         if( longLeverage == shortLeverage ):
                             leverage = longLeverage
-            
-            if( leverage != -1 ):
-                self.markets[ symbol ]['local'][ 'leverage' ] = leverage
-            elif( self.exchange.id != "kucoinfutures" and self.exchange.id != "binance" ): # we know kucoin is helpless. And apparently Binance.
-                print( " * W: refreshPositions: Couldn't find leverage for", self.exchange.id )
 
-            newPositionsList.append(position_c( symbol, thisPosition, self.markets[ symbol ] ))
+                elif( self.exchange.id == 'bingx' ):
+                    # they should always be the same
+                    longLeverage = response['data'].get('longLeverage')
+                    shortLeverage = response['data'].get('shortLeverage')
+                    if( longLeverage == shortLeverage ):
+                        leverage = longLeverage
         
-        self.positionslist = newPositionsList
+        if( leverage != -1 ):
+            if( not restored ):
+                self.setLocalState( symbol, 'leverage', leverage )
+        elif( self.exchange.id != "kucoinfutures" and self.exchange.id != "binance" ): # we know kucoin is helpless. And apparently Binance.
+            print( " * W: refreshPositions: Couldn't find leverage for", self.exchange.id )
 
-        if v:
-            for pos in self.positionslist:
-                print( tab + pos.generatePrintString() )
+        return position_c( symbol, thisPosition, self.markets[ symbol ] )
+
+
+    def queueOrder(self, order, fromAlert = True ):
+        # fromAlert: the order answers the alert being processed. The rest of a partially
+        # filled order doesn't, and stays out of the alert latency metrics
+        if( fromAlert and order.alertTimestamp == None ):
+            order.alertTimestamp = self.alertTimestamp
+        self.ordersQueue.append( order )
+        self.queuedSymbols[order.symbol] = self.queuedSymbols.get( order.symbol, 0 ) + 1
 
-            print('------------------------------')
+
+    def unqueueOrder(self, order ):
+        self.ordersQueue.remove( order )
+        count = self.queuedSymbols.get( order.symbol, 0 ) - 1
+        if( count > 0 ):
+            self.queuedSymbols[order.symbol] = count
+        else:
+            self.queuedSymbols.pop( order.symbol, None )
+
+
+    def activateOrder(self, order ):
+        order.lastPoll = time.monotonic()
+        self.activeOrders.append( order )
+        self.activeSymbols[order.symbol] = self.activeSymbols.get( order.symbol, 0 ) + 1
+
+
+    def deactivateOrder(self, order ):
+        self.activeOrders.remove( order )
+        self.invalidateBalance()
+        if( self.orderStream != None ):
+            self.orderStream.forget( order.id )
+        count = self.activeSymbols.get( order.symbol, 0 ) - 1
+        if( count > 0 ):
+            self.activeSymbols[order.symbol] = count
+        else:
+            self.activeSymbols.pop( order.symbol, None )
 
 
     def activeOrderForSymbol(self, symbol ):
-        for o in self.activeOrders:
-            if( o.symbol == symbol ):
-                return True
-        return False
+        return symbol in self.activeSymbols
+    
+
+    def isSymbolBusy(self, symbol ):
+        # the symbol has orders queued or being processed
+        return symbol in self.activeSymbols or symbol in self.queuedSymbols
     
 
-    def fetchClosedOrderById(self, symbol, id ):
+    def ordersFetchedByList(self)->bool:
+        # Phemex doesn't support fetch_order (by id) in swap mode, but it supports fetch_open_orders and fetch_closed_orders
+        return self.exchange.id == 'phemex' or self.exchange.id == 'bybit' or self.exchange.id == 'krakenfutures'
+
+
+    def fetchOrdersList(self, symbol, openOrders )->dict:
+        # returns the open or closed orders of the symbol by id. None if it failed
         try:
-            response = self.exchange.fetch_closed_orders( symbol, params = {'settleCoin':self.SETTLE_COIN} )
+            if( openOrders ):
+                response = self.exchange.fetch_open_orders( symbol, params = {'settleCoin':self.SETTLE_COIN} )
+            else:
+                response = self.exchange.fetch_closed_orders( symbol, params = {'settleCoin':self.SETTLE_COIN} )
         except Exception as e:
             #Exception: ccxt.base.errors.ExchangeError: phemex {"code":39999,"msg":"Please try again.","data":null}
             return None
+        return { o.get('id'): o for o in response }
 
-        for o in response:
-            if o.get('id') == id :
-                return o
-        if verbose : print( "r...", end = '' )
-        return None
-    
 
-    def fetchOpenOrderById(self, symbol, id ):
+    async def fetchOrdersListAsync(self, symbol, openOrders )->dict:
+        # same as fetchOrdersList but using the asyncio exchange
         try:
-            response = self.exchange.fetch_open_orders( symbol, params = {'settleCoin':self.SETTLE_COIN} )
+            if( openOrders ):
+                response = await self.asyncExchange.fetch_open_orders( symbol, params = {'settleCoin':self.SETTLE_COIN} )
+            else:
+                response = await self.asyncExchange.fetch_closed_orders( symbol, params = {'settleCoin':self.SETTLE_COIN} )
         except Exception as e:
-            #Exception: ccxt.base.errors.ExchangeError: phemex {"code":39999,"msg":"Please try again.","data":null}
             return None
+        return { o.get('id'): o for o in response }
+
+
+    def fetchOrderStatus(self, order ):
+        try:
+            return self.exchange.fetch_order( order.id, order.symbol )
+        except Exception as e:
+            if( not isinstance(e, ccxt.InvalidOrder) and 'order not exists' not in e.args[0] ):
+                self.print( " * E: fetchOrderStatus:", e, type(e) )
+        return None
 
-        for o in response:
-            if o.get('id') == id :
-                return o
-        if verbose : print( "r...", end = '' )
+
+    async def fetchOrderStatusAsync(self, order ):
+        # same as fetchOrderStatus but using the asyncio exchange
+        try:
+            return await self.asyncExchange.fetch_order( order.id, order.symbol )
+        except Exception as e:
+            if( not isinstance(e, ccxt.InvalidOrder) and 'order not exists' not in e.args[0] ):
+                self.print( " * E: fetchOrderStatus:", e, type(e) )
         return None
-    
 
-    def removeFirstCompletedOrder(self):
-        # go through the queue and remove the first completed order
-        for order in self.activeOrders:
-            if( order.timedOut() ):
-                self.print( " * E: Active Order Timed out", order.symbol, order.side, order.quantity, str(order.leverage)+'x' )
-                self.activeOrders.remove( order )
-                continue
 
-            # Phemex doesn't support fetch_order (by id) in swap mode, but it supports fetch_open_orders and fetch_closed_orders
-            if( self.exchange.id == 'phemex' or self.exchange.id == 'bybit' or self.exchange.id == 'krakenfutures' ):
-                if( order.type == 'limit' ):
-                    response = self.fetchOpenOrderById( order.symbol, order.id )
+    def fetchOrdersStatus(self, orders )->dict:
+        # returns a dictionary with the exchange response for each order
+        responses = {}
+
+        # when the orders stream is working we get the orders updates pushed to us.
+        # Polling is only used now and then to catch the updates we may have missed
+        if( self.orderStream != None ):
+            now = time.monotonic()
+            pollOrders = []
+            for order in orders:
+                update = self.orderStream.getUpdate( order.id )
+                if( update != None and ( order.type == 'limit' or update.get('status') in ( 'closed', 'canceled', 'filled' ) ) ):
+                    responses[order] = update
+                elif( self.orderStream.connected() and order.lastPoll + ORDER_POLL_FALLBACK > now ):
+                    responses[order] = None
                 else:
-                    response = self.fetchClosedOrderById( order.symbol, order.id )
-                if( response == None ):
-                    continue
+                    order.lastPoll = now
+                    pollOrders.append( order )
+            orders = pollOrders
+
+        if( len(orders) == 0 ):
+            return responses
+
+        if( self.ordersFetchedByList() ):
+            # one list for each symbol resolves all its orders. Limit orders are searched in the open orders.
+            groups = {}
+            for order in orders:
+                groups.setdefault( ( order.symbol, order.type == 'limit' ), [] ).append( order )
+            keys = list(groups.keys())
+            if( self.asyncExchange != None ):
+                lists = self.asyncGather( *[ self.fetchOrdersListAsync( symbol, openOrders ) for symbol, openOrders in keys ] )
             else:
-                try:
-                    response = self.exchange.fetch_order( order.id, order.symbol )
-                except Exception as e:
-                    if( isinstance(e, ccxt.InvalidOrder) or 'order not exists' in e.args[0] ):
-                        continue
+                lists = [ self.fetchOrdersList( symbol, openOrders ) for symbol, openOrders in keys ]
+
+            for key, ordersById in zip( keys, lists ):
+                if( isinstance(ordersById, Exception) ):
+                    ordersById = None
+                for order in groups[key]:
+                    responses[order] = ordersById.get( order.id ) if ordersById != None else None
+                    if( verbose and responses[order] == None ): print( "r...", end = '' )
+            return responses
+
+        if( self.asyncExchange != None ):
+            results = self.asyncGather( *[ self.fetchOrderStatusAsync( order ) for order in orders ] )
+            for order, response in zip( orders, results ):
+                responses[order] = None if isinstance(response, Exception) else response
+            return responses
+
+        for order in orders:
+            responses[order] = self.fetchOrderStatus( order )
+        return responses
+
+
+    def removeCompletedOrders(self)->bool:
+        # go through the active orders and remove the completed ones
+        orders = []
+        for order in list(self.activeOrders):
+            if( order.timedOut() ):
+                self.print( " * E: Active Order Timed out", order.symbol, order.side, order.quantity, str(order.leverage)+'x', symbol = order.symbol )
+                self.orderTimeouts += 1
+                self.deactivateOrder( order )
+                continue
+            orders.append( order )
 
-                    self.print( " * E: removeFirstCompletedOrder:", e, type(e) )
-                    continue
-                
-            
-            if( response == None ): # FIXME: Check if this is really happening by printing it.
-                print( ' * E: removeFirstCompletedOrder: fetch_order returned None' )
+        if( len(orders) == 0 ):
+            return False
+
+        completed = False
+        responses = self.fetchOrdersStatus( orders )
+        for order in orders:
+            response = responses.get( order )
+            if( response == None ):
                 continue
             if( len(response) == 0 ):
-                print( ' * E: removeFirstCompletedOrder: fetch_order returned empty' )
+                print( ' * E: removeCompletedOrders: fetch_order returned empty' )
                 continue
                         
             status = response.get('status')
-            remaining = float( response.get('remaining') )
+            remaining = float( response.get('remaining') or 0.0 )
             price = response.get('price')
             if verbose : pprint( response )
 
             if( order.type == 'limit' ):
                 if( self.exchange.id == 'coinex' ) : response['clientOrderId'] = response['info']['client_id'] #HACK!!
-                self.print( " * Linmit order placed:", order.symbol, order.side, order.quantity, str(order.leverage)+"x", "at price", price, 'id', response.get('clientOrderId') )
-                self.activeOrders.remove( order )
-                return True
+                self.print( " * Linmit order placed:", order.symbol, order.side, order.quantity, str(order.leverage)+"x", "at price", price, 'id', response.get('clientOrderId'), symbol = order.symbol )
+                self.deactivateOrder( order )
+                completed = True
+                continue
 
             if( remaining > 0 and (status == 'canceled' or status == 'closed') ):
                 print("r...", end = '')
-                self.ordersQueue.append( order_c( order.symbol, order.side, remaining, order.leverage, 0.5 ) )
-                self.activeOrders.remove( order )
-                return True
+                self.queueOrder( order_c( order.symbol, order.side, remaining, order.leverage, 0.5 ), fromAlert = False )
+                self.deactivateOrder( order )
+                completed = True
+                continue
             
             if ( status == 'closed' or status == 'filled' ):
-                self.print( " * Order successful:", order.symbol, order.side, order.quantity, str(order.leverage)+"x", "at price", price, 'id', order.id )
-                self.activeOrders.remove( order )
-                return True
-        return False
+                self.print( " * Order successful:", order.symbol, order.side, order.quantity, str(order.leverage)+"x", "at price", price, 'id', order.id, symbol = order.symbol )
+                self.fillLatency.observe( time.monotonic() - order.submitTimestamp )
+                self.deactivateOrder( order )
+                completed = True
+        return completed
     
 
     def cancelLimitOrder(self, symbol, customID )->bool:
@@ -1312,6 +2256,7 @@ class account_c:
                 self.print( ' * E: cancelLimitOrder:', e.args[0], type(e) )
 
         else:
+            self.invalidateBalance()
             self.print( " * Linmit order [", customID, "] cancelled." )
         return True
     
@@ -1328,6 +2273,7 @@ class account_c:
                         self.print( ' * E: cancelAllOrders:', e.args[0], type(e) )
                     # I've tried cancelling when there were no orders but it reported no error. Maybe I missed something.
                 else:
+                    self.invalidateBalance()
                     self.print( ' * All', symbol, 'orders have been cancelled' )
                 return True
 
@@ -1351,6 +2297,8 @@ class account_c:
                     else:
                         cancelledCount += 1
 
+            if( cancelledCount > 0 ):
+                self.invalidateBalance()
             self.print( 'cancelAllOrders:', cancelledCount, 'orders cancelled' )
             return True
                 
@@ -1359,20 +2307,42 @@ class account_c:
     def updateOrdersQueue(self):
 
         # see if any active order was completed and delete it
-        while self.removeFirstCompletedOrder():
-            continue
+        self.removeCompletedOrders()
 
         if( len(self.ordersQueue) == 0 ):
             return
-        
-        # go through the queue activating every symbol that doesn't have an active order
+
+        # the queue is sent in rounds. A round takes the first order of every symbol without an active order,
+        # so when an order is filled at once the next order of its symbol still goes out in this frame
+        attempted = set()
+        while True:
+            batch = self.prepareOrdersBatch( attempted )
+            if( len(batch) == 0 ):
+                return
+            responses = self.submitOrders( batch )
+            for order, params in batch:
+                self.handleOrderResponse( order, responses.get( order ) )
+
+
+    def prepareOrdersBatch(self, attempted:set )->list:
+        # pick the orders to send now, at most one for each symbol, and set up their symbols and parameters.
+        # The orders of one symbol depend on the previous one being filled (a reversal closes before opening,
+        # a margin mode change closes and reopens), so they're still sent one after another. Only the orders
+        # of different symbols share a batch.
+        # Returns a list of ( order, params )
+        batch = []
+        symbols = set()
         for order in list(self.ordersQueue):
+            if( order in attempted or order.symbol in symbols ):
+                continue
+
             if( self.activeOrderForSymbol(order.symbol) ):
                 continue
 
             if( order.timedOut() ):
-                self.print( timeNow(), " * Order Timed out", order.symbol, order.side, order.quantity, str(order.leverage)+'x' )
-                self.ordersQueue.remove( order )
+                self.print( timeNow(), " * Order Timed out", order.symbol, order.side, order.quantity, str(order.leverage)+'x', symbol = order.symbol )
+                self.orderTimeouts += 1
+                self.unqueueOrder( order )
                 continue
 
             if( order.delayed() ):
@@ -1390,7 +2360,7 @@ class account_c:
                     self.print( " * Leverage changed to", self.markets[ order.symbol ]['local']['leverage'] )
                 else:
                     self.print( " * E: Failed to change leverage." )
-                self.ordersQueue.remove( order )
+                self.unqueueOrder( order )
                 continue
 
 
@@ -1437,166 +2407,288 @@ class account_c:
                 price = account.fetchAveragePrice( order.symbol )
                 print( timeNow(), " * Debug Order:", order.symbol, order.side, f": {(order.quantity * price)/float(order.leverage):.2f}$" )
                 print( timeNow(), " * Debug Order:", f"{order.quantity} contracts", str(order.leverage)+'x' )
-                self.ordersQueue.remove( order )
+                self.unqueueOrder( order )
                 continue
 
-            # send the actual order
-            try:
-                response = self.exchange.create_order( order.symbol, order.type, order.side, order.quantity, order.price, params )
-                #pprint( response )
+            attempted.add( order )
+            symbols.add( order.symbol )
+            batch.append( ( order, params ) )
 
+        return batch
+
+
+    def batchOrdersEnabled(self)->bool:
+        return BATCH_ORDERS and self.batchOrders and self.exchange.has.get('createOrders') and self.exchange.id not in BATCH_ORDERS_UNSUPPORTED
+
+
+    def submitOrders(self, batch:list )->dict:
+        # send the orders at once: in batches when the exchange has a batch endpoint, or concurrently.
+        # Returns the response to each order, or the exception raised for it
+        responses = {}
+        if( len(batch) > 1 and self.batchOrdersEnabled() ):
+            rejected = []
+            for i in range( 0, len(batch), BATCH_ORDERS_MAX ):
+                rejected += self.createOrdersBatch( batch[i:i + BATCH_ORDERS_MAX], responses )
+            batch = rejected
+
+        if( len(batch) > 1 and self.asyncExchange != None ):
+            results = self.asyncGather( *[ self.asyncExchange.create_order( order.symbol, order.type, order.side, order.quantity, order.price, params ) for order, params in batch ] )
+            for ( order, params ), response in zip( batch, results ):
+                responses[order] = response
+            return responses
+
+        for order, params in batch:
+            try:
+                responses[order] = self.exchange.create_order( order.symbol, order.type, order.side, order.quantity, order.price, params )
             except Exception as e:
-                a = e.args[0]
-                
-                if( isinstance(e, ccxt.InsufficientFunds) or '"code":"40762"' in a or 'code":101204' in a or '"code":-4131' in a
-                   or 'code":101253' in a or 'balance not enough' in a ):
-                    # coinex E: Cancelling: balance not enough <class 'ccxt.base.errors.ExchangeError'>
-                    # KUCOIN: kucoinfutures Balance insufficient. The order would cost 304.7268292695.
-                    # BITGET: {"code":"40754","msg":"balance not enough","requestTime":1689363604542,"data":null}
-                    # bitget {"code":"40762","msg":"The order size is greater than the max open size","requestTime":1695925262092,"data":null} <class 'ccxt.base.errors.ExchangeError'>
-                    # bingx {"code":101204,"msg":"Insufficient margin","data":{}}
-                    # bingx {"code":101253,"msg":"Insufficient margin","data":{}}
-                    # phemex {"code":11082,"msg":"TE_CANNOT_COVER_ESTIMATE_ORDER_LOSS","data":null}
-                    # phemex {"code":11001,"msg":"TE_NO_ENOUGH_AVAILABLE_BALANCE","data":null}
-                    # bybit {"retCode":140007,"retMsg":"remark:order[1643476 23006bb4-630a-4917-af0d-5412aaa1c950] fix price failed for CannotAffordOrderCost.","result":{},"retExtInfo":{},"time":1690540657794}
-                    # bybit {"retCode":110007,"retMsg":"Insufficient available balance","result":{},"retExtInfo":{},"
-                    # binance "code":-2019,"msg":"Margin is insufficient."
-                    # krakenfutures: createOrder failed due to insufficientAvailableFunds
-                    # binance {"code":-2027,"msg":"Exceeded the maximum allowable position at current leverage."}
-                    # binance {"code":-4131,"msg":"The counterparty's best price does not meet the PERCENT_PRICE filter limit."} <class 'ccxt.base.errors.ExchangeError'>
-                    # binance {"code":-4131,"msg":"The counterparty's best price does not meet the PERCENT_PRICE filter limit."}
-                    precision = self.findPrecisionForSymbol( order.symbol )
-                    # try first reducing it to our estimation of current balance
-
-                    # This doesn't belong to insufficient funds, but cctx sends it here
-                    if 'code":-4131' in a:
-                        self.print( " * E: The counterparty's best price does not meet the PERCENT_PRICE filter limit. Retrying in 3 seconds" )
-                        order.delay += 2.0
-
-                    elif( not order.reduced ):
-                        oldQuantity = order.quantity
-                        price = self.fetchSellPrice(order.symbol) if( type == 'sell' ) else self.fetchBuyPrice(order.symbol)
-                        available = self.fetchAvailableBalance() * 0.985
-                        order.quantity = self.contractsFromUSDT( order.symbol, available, price, order.leverage )
-                        order.reduced = True
+                responses[order] = e
+        return responses
+
+
+    def createOrdersBatch(self, batch:list, responses:dict )->list:
+        # place the orders with a single create_orders request. Returns the orders which have to be sent again
+        # one by one: the ones the exchange rejected (so their errors go through the usual handling) or all of
+        # them when the batch was refused before placing anything
+        try:
+            results = self.exchange.create_orders( [ { 'symbol': order.symbol, 'type': order.type, 'side': order.side,
+                                                        'amount': order.quantity, 'price': order.price, 'params': params } for order, params in batch ] )
+        except Exception as e:
+            if( isinstance(e, ccxt.NotSupported) or isinstance(e, ccxt.ArgumentsRequired) ):
+                # ccxt refused the batch before sending it. This exchange won't take our batches
+                self.print( ' * E: createOrders:', e, '- Sending the orders one by one from now on' )
+                self.batchOrders = False
+                return batch
+            if( isinstance(e, ccxt.ExchangeError) and type(e) != ccxt.ExchangeError ):
+                # the exchange refused the request as a whole and ccxt raised the typed error of one of the orders
+                # (okx answers code 1 when every order failed). Nothing was placed. Send them one by one so each
+                # order gets its own error
+                return batch
+            # network errors, timeouts and unknown errors: we can't know if any order was placed. Don't send them twice
+            for order, params in batch:
+                responses[order] = e
+            return []
+
+        rejected = []
+        for i, ( order, params ) in enumerate( batch ):
+            response = results[i] if i < len(results) else None
+            if( response != None and self.batchOrderRejected( response ) ):
+                rejected.append( ( order, params ) )
+            elif( response == None or response.get('id') == None ):
+                # it may have been placed anyway. Don't send it twice
+                responses[order] = ccxt.ExchangeError( self.exchange.id + ' createOrders: no order id in the response. The order may have been placed' )
+            else:
+                responses[order] = response
+        return rejected
+
+
+    def batchOrderRejected(self, response:dict )->bool:
+        # an order of a batch which was surely not placed: ccxt marked it as rejected or the exchange left an error code in it
+        if( response.get('status') == 'rejected' ):
+            return True
+        info = response.get('info')
+        if( not isinstance(info, dict) ):
+            return False
+        for key in BATCH_ORDERS_ERROR_KEYS:
+            if( info.get(key) != None and str(info.get(key)) not in BATCH_ORDERS_SUCCESS_CODES ):
+                return True
+        return False
+
+
+    def handleOrderResponse(self, order, response ):
+        # act on the exchange answer to a sent order: activate it, finish it, retry it later or cancel it
+        if( isinstance(response, Exception) ):
+            e = response
+            a = e.args[0]
+            
+            if( isinstance(e, ccxt.InsufficientFunds) or '"code":"40762"' in a or 'code":101204' in a or '"code":-4131' in a
+               or 'code":101253' in a or 'balance not enough' in a ):
+                # coinex E: Cancelling: balance not enough <class 'ccxt.base.errors.ExchangeError'>
+                # KUCOIN: kucoinfutures Balance insufficient. The order would cost 304.7268292695.
+                # BITGET: {"code":"40754","msg":"balance not enough","requestTime":1689363604542,"data":null}
+                # bitget {"code":"40762","msg":"The order size is greater than the max open size","requestTime":1695925262092,"data":null} <class 'ccxt.base.errors.ExchangeError'>
+                # bingx {"code":101204,"msg":"Insufficient margin","data":{}}
+                # bingx {"code":101253,"msg":"Insufficient margin","data":{}}
+                # phemex {"code":11082,"msg":"TE_CANNOT_COVER_ESTIMATE_ORDER_LOSS","data":null}
+                # phemex {"code":11001,"msg":"TE_NO_ENOUGH_AVAILABLE_BALANCE","data":null}
+                # bybit {"retCode":140007,"retMsg":"remark:order[1643476 23006bb4-630a-4917-af0d-5412aaa1c950] fix price failed for CannotAffordOrderCost.","result":{},"retExtInfo":{},"time":1690540657794}
+                # bybit {"retCode":110007,"retMsg":"Insufficient available balance","result":{},"retExtInfo":{},"
+                # binance "code":-2019,"msg":"Margin is insufficient."
+                # krakenfutures: createOrder failed due to insufficientAvailableFunds
+                # binance {"code":-2027,"msg":"Exceeded the maximum allowable position at current leverage."}
+                # binance {"code":-4131,"msg":"The counterparty's best price does not meet the PERCENT_PRICE filter limit."} <class 'ccxt.base.errors.ExchangeError'>
+                # binance {"code":-4131,"msg":"The counterparty's best price does not meet the PERCENT_PRICE filter limit."}
+                precision = self.findPrecisionForSymbol( order.symbol )
+                # try first reducing it to our estimation of current balance
+
+                # This doesn't belong to insufficient funds, but cctx sends it here
+                if 'code":-4131' in a:
+                    self.print( " * E: The counterparty's best price does not meet the PERCENT_PRICE filter limit. Retrying in 3 seconds" )
+                    order.delay += 2.0
+                    self.orderRetries += 1
+
+                elif( not order.reduced ):
+                    oldQuantity = order.quantity
+                    price = self.fetchSellPrice(order.symbol) if( type == 'sell' ) else self.fetchBuyPrice(order.symbol)
+                    available = self.fetchAvailableBalance( 0 ) * 0.985 # the exchange disagrees with any snapshot we had
+                    order.quantity = self.contractsFromUSDT( order.symbol, available, price, order.leverage )
+                    order.reduced = True
+                    if( order.quantity < self.findMinimumAmountForSymbol(order.symbol) ):
+                        self.print( ' * E: Balance insufficient: Minimum contracts required:', self.findMinimumAmountForSymbol(order.symbol), ' Cancelling')
+                        self.unqueueOrder( order )
+                    else:
+                        self.print( ' * E: Balance insufficient: Was', oldQuantity, 'Reducing to', order.quantity, "contracts")
+                        self.orderRetries += 1
+                        
+                elif( order.quantity > precision ):
+                    if( order.quantity < 20 and precision >= 1 ):
+                        self.print( ' * E: Balance insufficient: Reducing by one contract')
+                        order.quantity -= precision
+                        self.orderRetries += 1
+                    else:
+                        order.quantity = roundDownTick( order.quantity * 0.95, precision )
                         if( order.quantity < self.findMinimumAmountForSymbol(order.symbol) ):
-                            self.print( ' * E: Balance insufficient: Minimum contracts required:', self.findMinimumAmountForSymbol(order.symbol), ' Cancelling')
-                            self.ordersQueue.remove( order )
+                            self.print( ' * E: Balance insufficient: Cancelling' )
+                            self.unqueueOrder( order )
                         else:
-                            self.print( ' * E: Balance insufficient: Was', oldQuantity, 'Reducing to', order.quantity, "contracts")
-                            
-                    elif( order.quantity > precision ):
-                        if( order.quantity < 20 and precision >= 1 ):
-                            self.print( ' * E: Balance insufficient: Reducing by one contract')
-                            order.quantity -= precision
-                        else:
-                            order.quantity = roundDownTick( order.quantity * 0.95, precision )
-                            if( order.quantity < self.findMinimumAmountForSymbol(order.symbol) ):
-                                self.print( ' * E: Balance insufficient: Cancelling' )
-                                self.ordersQueue.remove( order )
-                            else:
-                                self.print( ' * E: Balance insufficient: Reducing by 5%')
-
-                    else: # cancel the order
-                        self.print( ' * E: Balance insufficient: Cancelling' )
-                        self.ordersQueue.remove( order )
-
-                    continue # back to the orders loop
-
-
-                if( isinstance(e, ccxt.InvalidOrder) ):
-                    # ERROR Cancelling: okx {"code":"1","data":[{"clOrdId":"001","ordId":"","sCode":"51006","sMsg":"Order price is not within the price limit (Maximum buy price: 26,899.6; minimum sell price: 25,844.6)","tag":""}],"inTime":"1695698840518495","msg":"","outTime":"1695698840518723"}
-                    # bitget {"code":"45110","msg":"less than the minimum amount 5 USDT","requestTime":1719060978643,"data":null}
-                    if 'Order price is not within' in a:
-                        d = json.loads(a.lstrip(self.exchange.id + ' '))
-                        self.print( ' * E:', d['data'][0].get('sMsg') )
-                        self.ordersQueue.remove( order )
-                    elif 'invalidSize' in a or 'code":"45110' in a:
-                        self.print( ' * E: Order size invalid:', order.quantity, 'x'+str(order.leverage) )
-                        self.ordersQueue.remove( order )
-                    elif '"retCode":20094' in a or '"code":-4015' in a or 'ID already exists' in a:
-                        self.print( ' * E: Cancelling Linmit order: ID [', order.customID, '] was used before' )
-                        self.ordersQueue.remove( order )
-                    else:
-                        self.print( ' * E: Invalid Order. Cancelling', e )
-                        self.ordersQueue.remove( order )
-                    
-                    continue # back to the orders loop
+                            self.print( ' * E: Balance insufficient: Reducing by 5%')
+                            self.orderRetries += 1
 
-                # 12:13:18 [cross/bitget]  * E: UpdateOrdersQueue: Unhandled exception. Cancelling: bitget {"code":"40786","msg":"Duplicate clientOid","requestTime":1769253198131,"data":null} <class 'ccxt.base.errors.ExchangeError'>
-                if 'Duplicate clientOid' in a:
-                    self.print( ' * E: Limit order ID was already used. Cancelling' )
-                    self.ordersQueue.remove( order )
-                    continue
+                else: # cancel the order
+                    self.print( ' * E: Balance insufficient: Cancelling' )
+                    self.unqueueOrder( order )
 
+                return
 
-                # bitget {"code":"22002","msg":"No position to close","requestTime":1765292553209,"data":null} <class 'ccxt.base.errors.ExchangeError'>
-                if 'No position' in a:
-                    self.print( f'{order.symbol}  No position to close.' )
-                    self.ordersQueue.remove( order )
-                    continue
 
-                #HACK!! this is the shadiest hack ever, but bingx is returning a 'server busy' response
-                # when we try to place a limit order with a clientOrderID that has been already used.
-                # Basically, he's ghosting us!! It may have found it super offensive.
-                if( self.exchange.id == 'bingx' and order.type == 'limit' and '"code":101500' in a ):
+            if( isinstance(e, ccxt.InvalidOrder) ):
+                # ERROR Cancelling: okx {"code":"1","data":[{"clOrdId":"001","ordId":"","sCode":"51006","sMsg":"Order price is not within the price limit (Maximum buy price: 26,899.6; minimum sell price: 25,844.6)","tag":""}],"inTime":"1695698840518495","msg":"","outTime":"1695698840518723"}
+                # bitget {"code":"45110","msg":"less than the minimum amount 5 USDT","requestTime":1719060978643,"data":null}
+                if 'Order price is not within' in a:
+                    d = json.loads(a.lstrip(self.exchange.id + ' '))
+                    self.print( ' * E:', d['data'][0].get('sMsg') )
+                    self.unqueueOrder( order )
+                elif 'invalidSize' in a or 'code":"45110' in a:
+                    self.print( ' * E: Order size invalid:', order.quantity, 'x'+str(order.leverage) )
+                    self.unqueueOrder( order )
+                elif '"retCode":20094' in a or '"code":-4015' in a or 'ID already exists' in a:
                     self.print( ' * E: Cancelling Linmit order: ID [', order.customID, '] was used before' )
-                    self.ordersQueue.remove( order )
-                    continue
-                    
+                    self.unqueueOrder( order )
+                else:
+                    self.print( ' * E: Invalid Order. Cancelling', e )
+                    self.unqueueOrder( order )
+                
+                return
 
-                # bingx {"code":101500,"msg":"The current system is busy, please try again later","data":{}} <class 'ccxt.base.errors.ExchangeError'>
-                # bitget {"code":"400172","msg":"The order validity period is invalid","requestTime":1697878512831,"data":null} <class 'ccxt.base.errors.ExchangeError'>
-                # E: UpdateOrdersQueue: Unhandled exception. Cancelling: binance {"code":-1008,"msg":"Server is currently overloaded with other requests. Please try again in a few minutes."}
-                if( 'Too Many Requests' in a or 'too many request' in a 
-                   or 'service too busy' in a or 'system is busy' in a
-                   or 'code":-1008' in a ):
-                    #set a bigger delay and try again
-                    order.delay += 1.0
-                    print( " * Server too busy. Retrying.", type(e) )
-                    continue
+            # 12:13:18 [cross/bitget]  * E: UpdateOrdersQueue: Unhandled exception. Cancelling: bitget {"code":"40786","msg":"Duplicate clientOid","requestTime":1769253198131,"data":null} <class 'ccxt.base.errors.ExchangeError'>
+            if 'Duplicate clientOid' in a:
+                self.print( ' * E: Limit order ID was already used. Cancelling' )
+                self.unqueueOrder( order )
+                return
 
 
-                # [bitget/bitget] bitget {"code":"45110","msg":"less than the minimum amount 5 USDT","requestTime":1689481837614,"data":null}
-                # The deviation between your delegated price and the index price is greater than 20%, you can appropriately adjust your delegation price and try again     
-                self.print( ' * E: UpdateOrdersQueue: Unhandled exception. Cancelling:', a, type(e) )
-                self.ordersQueue.remove( order )
-                continue # back to the orders loop
+            # bitget {"code":"22002","msg":"No position to close","requestTime":1765292553209,"data":null} <class 'ccxt.base.errors.ExchangeError'>
+            if 'No position' in a:
+                self.print( f'{order.symbol}  No position to close.' )
+                self.unqueueOrder( order )
+                return
 
+            #HACK!! this is the shadiest hack ever, but bingx is returning a 'server busy' response
+            # when we try to place a limit order with a clientOrderID that has been already used.
+            # Basically, he's ghosting us!! It may have found it super offensive.
+            if( self.exchange.id == 'bingx' and order.type == 'limit' and '"code":101500' in a ):
+                self.print( ' * E: Cancelling Linmit order: ID [', order.customID, '] was used before' )
+                self.unqueueOrder( order )
+                return
+                
 
-            if( response.get('id') == None ):
-                self.print( " * E: Order denied:", response['info'], "Cancelling" )
-                self.ordersQueue.remove( order )
-                continue # back to the orders loop
+            # bingx {"code":101500,"msg":"The current system is busy, please try again later","data":{}} <class 'ccxt.base.errors.ExchangeError'>
+            # bitget {"code":"400172","msg":"The order validity period is invalid","requestTime":1697878512831,"data":null} <class 'ccxt.base.errors.ExchangeError'>
+            # E: UpdateOrdersQueue: Unhandled exception. Cancelling: binance {"code":-1008,"msg":"Server is currently overloaded with other requests. Please try again in a few minutes."}
+            if( 'Too Many Requests' in a or 'too many request' in a 
+               or 'service too busy' in a or 'system is busy' in a
+               or 'code":-1008' in a ):
+                #set a bigger delay and try again
+                order.delay += 1.0
+                self.orderRetries += 1
+                print( " * Server too busy. Retrying.", type(e) )
+                return
 
-            order.id = response.get('id')
-            status = response.get('status')
-            remaining = response.get('remaining')
-            if( remaining != None and remaining > 0 and (status == 'canceled' or status == 'closed') ):
-                print("r...", end = '')
-                self.ordersQueue.append( order_c( order.symbol, order.side, remaining, order.leverage, 0.5 ) )
-                self.ordersQueue.remove( order )
-                continue
-            if( (remaining == None or remaining == 0) and (response.get('status') == 'closed' or response.get('status') == 'filled') ):
-                self.print( " * Order successful:", order.symbol, order.side, order.quantity, str(order.leverage)+"x", "at price", response.get('price'), 'id', order.id )
-                self.ordersQueue.remove( order )
-                continue
 
-            if verbose : print( timeNow(), " * Activating Order", order.symbol, order.side, order.quantity, str(order.leverage)+'x', 'id', order.id )
-            self.activeOrders.append( order )
-            self.ordersQueue.remove( order )
+            # [bitget/bitget] bitget {"code":"45110","msg":"less than the minimum amount 5 USDT","requestTime":1689481837614,"data":null}
+            # The deviation between your delegated price and the index price is greater than 20%, you can appropriately adjust your delegation price and try again     
+            self.print( ' * E: UpdateOrdersQueue: Unhandled exception. Cancelling:', a, type(e) )
+            self.unqueueOrder( order )
+            return
+
+
+        if( response.get('id') == None ):
+            self.print( " * E: Order denied:", response['info'], "Cancelling" )
+            self.unqueueOrder( order )
+            return
+
+        order.id = response.get('id')
+        order.submitTimestamp = time.monotonic()
+        if( order.alertTimestamp != None ):
+            self.submitLatency.observe( order.submitTimestamp - order.alertTimestamp )
+        self.invalidateBalance()
+        self.touchedSymbols.add( order.symbol )
+        status = response.get('status')
+        remaining = response.get('remaining')
+        if( remaining != None and remaining > 0 and (status == 'canceled' or status == 'closed') ):
+            print("r...", end = '')
+            self.queueOrder( order_c( order.symbol, order.side, remaining, order.leverage, 0.5 ), fromAlert = False )
+            self.unqueueOrder( order )
+            return
+        if( (remaining == None or remaining == 0) and (response.get('status') == 'closed' or response.get('status') == 'filled') ):
+            self.print( " * Order successful:", order.symbol, order.side, order.quantity, str(order.leverage)+"x", "at price", response.get('price'), 'id', order.id, symbol = order.symbol )
+            self.fillLatency.observe( time.monotonic() - order.submitTimestamp )
+            self.unqueueOrder( order )
+            return
+
+        if verbose : print( timeNow(), " * Activating Order", order.symbol, order.side, order.quantity, str(order.leverage)+'x', 'id', order.id )
+        self.activateOrder( order )
+        self.unqueueOrder( order )
+
+
+    def alertNeedsPrice( self, alert:dict )->bool:
+        # will the alert quantity need to be converted to contracts?
+        if( alert['command'] == 'cancel' or alert['command'] == 'changeleverage' ):
+            return False
+        if( alert['isBaseCurrency'] and alert['nominal'] and self.findContractSizeForSymbol(alert['symbol']) == 1 ):
+            return False
+        return alert['isUSDT'] or alert['isBaseCurrency'] or ( alert['isPercentage'] and alert['command'] != 'close' )
+
 
-    
     def proccessAlert( self, alert:dict ):
+        # the orders queued by the alert take its timestamp for the latency metrics
+        self.alertTimestamp = alert['timestamp']
+        try:
+            self.proccessAlertCommand( alert )
+        finally:
+            self.alertTimestamp = None
+
+
+    def proccessAlertCommand( self, alert:dict ):
 
         self.print( ' ' )
-        self.print( " ALERT:", alert['alert'] )
+        self.print( " ALERT:", alert['alert'], symbol = alert['symbol'] )
         self.print('----------------------------')
 
         # This is our first communication with the server, and (afaik) it will only fail when the server is not available.
-        # so we use it as a server availability check as well as for finding the available balance
+        # so we use it as a server availability check as well as for finding the available balance.
+        # (unless the balance was fetched a moment ago)
+        topOfBook = None
         try:
-            available = self.fetchAvailableBalance() * 0.985
+            if( self.asyncExchange != None and self.alertNeedsPrice( alert ) ):
+                # fetch the prices for the conversion at the same time
+                balance, topOfBook = self.asyncGather( self.fetchBalanceAsync(), self.fetchTopOfBookAsync( alert['symbol'] ) )
+                if( isinstance(balance, Exception) ):
+                    raise balance
+                if( isinstance(topOfBook, Exception) ):
+                    topOfBook = None
+                available = float( balance.get( 'free' ) ) * 0.985
+            else:
+                available = self.fetchAvailableBalance() * 0.985
         except Exception as e:
             a = e.args[0]
             if( isinstance(e, ccxt.OnMaintenance) or isinstance(e, ccxt.NetworkError) 
@@ -1652,7 +2744,7 @@ class account_c:
         
         # bybit is too slow at updating positions after an order is made, so make sure they're updated
         if( self.exchange.id == 'bybit' and (command == 'position' or command == 'close') ):
-            self.refreshPositions( False )
+            self.refreshSymbolPositions( [symbol], False )
 
         minOrder = self.findMinimumAmountForSymbol(symbol)
         leverage = self.verifyLeverageRange( symbol, leverage )
@@ -1676,7 +2768,7 @@ class account_c:
                 # We don't know for sure yet if it's a buy or a sell, so we average
                 oldQuantity = quantity
                 try:
-                    price = self.fetchAveragePrice(symbol)
+                    price = self.averagePrice( *topOfBook ) if topOfBook != None else self.fetchAveragePrice(symbol)
                     
                 except ccxt.ExchangeError as e:
                     self.print( " * E: proccessAlert->fetchAveragePrice:", e )
@@ -1716,7 +2808,7 @@ class account_c:
             if( self.markets[ symbol ]['local']['leverage'] == leverage ):
                 self.print( " * Position already has leverage:", leverage )
                 return
-            self.ordersQueue.append( order_c( symbol, 'changeleverage', leverage = leverage ) )
+            self.queueOrder( order_c( symbol, 'changeleverage', leverage = leverage ) )
             return
             
 
@@ -1733,9 +2825,9 @@ class account_c:
 
 
             if( positionSide == 'long' ):
-                self.ordersQueue.append( order_c( symbol, 'sell', positionContracts, 0 ) )
+                self.queueOrder( order_c( symbol, 'sell', positionContracts, 0 ) )
             else: 
-                self.ordersQueue.append( order_c( symbol, 'buy', positionContracts, 0 ) )
+                self.queueOrder( order_c( symbol, 'buy', positionContracts, 0 ) )
 
             return
 
@@ -1753,9 +2845,9 @@ class account_c:
             elif( self.markets[symbol]['local']['marginMode'] != self.MARGIN_MODE and self.exchange.has['setMarginMode'] ):
                 # to change marginMode we need to close the old position first
                 if( pos.getKey('side') == 'long' ):
-                    self.ordersQueue.append( order_c( symbol, 'sell', pos.getKey('contracts'), 0 ) )
+                    self.queueOrder( order_c( symbol, 'sell', pos.getKey('contracts'), 0 ) )
                 else: 
-                    self.ordersQueue.append( order_c( symbol, 'buy', pos.getKey('contracts'), 0 ) )
+                    self.queueOrder( order_c( symbol, 'buy', pos.getKey('contracts'), 0 ) )
                 # Then create the order for the new position
                 if( quantity < 0 ):
                     command = 'sell'
@@ -1803,7 +2895,7 @@ class account_c:
                 if( quantity < minOrder and not reducing ):
                     # we don't need to buy nor sell, but do we need to change the leverage?
                     if( leverage != self.markets[ symbol ]['local']['leverage'] ):
-                        self.ordersQueue.append( order_c( symbol, 'changeleverage', leverage = leverage ) )
+                        self.queueOrder( order_c( symbol, 'changeleverage', leverage = leverage ) )
                     else:
                         self.print( " * Order completed: Request matched current position" )
                     return
@@ -1842,12 +2934,12 @@ class account_c:
                     # bingx must make one order for close and a second one for the new position
                     if( self.exchange.id == 'bingx' ):
                         if( quantity > positionContracts ):
-                            self.ordersQueue.append( order_c( symbol, command, positionContracts, 0 ) )
+                            self.queueOrder( order_c( symbol, command, positionContracts, 0 ) )
                             quantity -= positionContracts
-                            self.ordersQueue.append( order_c( symbol, command, quantity, leverage ) )
+                            self.queueOrder( order_c( symbol, command, quantity, leverage ) )
                             return
                         
-                        self.ordersQueue.append( order_c( symbol, command, quantity, leverage, reduceOnly=True ) )
+                        self.queueOrder( order_c( symbol, command, quantity, leverage, reduceOnly=True ) )
                         return
                     
                     # FIXME: Bybit takes the fees on top of the order which makes it fail with insuficcient
@@ -1857,10 +2949,10 @@ class account_c:
                     #
                     # FIXME: Temporarily using this path for OKX too
                     if( ( self.exchange.id == 'bybit' or self.exchange.id == 'okx' ) and quantity > positionContracts ):
-                        self.ordersQueue.append( order_c( symbol, command, positionContracts, 0, reduceOnly = True ) )
+                        self.queueOrder( order_c( symbol, command, positionContracts, 0, reduceOnly = True ) )
                         quantity -= positionContracts
                         if( quantity > minOrder ):
-                            self.ordersQueue.append( order_c( symbol, command, quantity, leverage ) )
+                            self.queueOrder( order_c( symbol, command, quantity, leverage ) )
                         return
 
                     if( quantity >= canDoContracts + positionContracts ):
@@ -1873,12 +2965,12 @@ class account_c:
                                 order1 -= diff
 
                         # first order is the contracts in the position and the contracs we can afford with the liquidity
-                        self.ordersQueue.append( order_c( symbol, command, order1, leverage ) )
+                        self.queueOrder( order_c( symbol, command, order1, leverage ) )
 
                         # second order is whatever we can afford with the former position contracts + the change
                         quantity -= order1
                         if( quantity >= minOrder ): #we are done (should never happen)
-                            self.ordersQueue.append( order_c( symbol, command, quantity, leverage, 1.0 ) )
+                            self.queueOrder( order_c( symbol, command, quantity, leverage, 1.0 ) )
 
                         return
                 # fall through
@@ -1897,77 +2989,114 @@ class account_c:
                 order.customID = customID
                 order.price = priceLimit
 
-            self.ordersQueue.append( order )
+            self.queueOrder( order )
             return
 
         self.print( " * E: Something went wrong. No order was placed")
 
 
 accounts = []
+accountsByName = {}
+ALL_ACCOUNTS = 'allaccounts' # reserved name. Alerts and requests using it target every account
 
 
 
 
 def stringToValue( arg )->float:
     try:
-        float(arg)
+        return float(arg)
     except ValueError:
-        value = None
-    else:
-        value = float(arg)
-    return value
+        return None
 
 
 def updateOrdersQueue():
+    # process one frame of every account's orders queue. The accounts workers do this on their own
     for account in accounts:
-        numOrders = len(account.ordersQueue) + len(account.activeOrders)
-        account.updateOrdersQueue()
-
-        # see if we have any alert pending to be proccessed
-        if( len(account.latchedAlerts) ):
-            positionsRefreshed = False
-            for alert in list(account.latchedAlerts):
-                if( alert.get('delayTimestamp') != None ):
-                    alert.get('delayTimestamp') < time.monotonic()
-                    continue
+        ordersWorkerFrame( account )
 
-                busy = False
-                for order in account.activeOrders:
-                    if( order.symbol == alert['symbol'] ):
-                        busy = True
-                        break
-                for order in account.ordersQueue:
-                    if( order.symbol == alert['symbol'] ):
-                        busy = True
-                        break
-                
-                if( not busy ):
-                    if( not positionsRefreshed ):
-                        account.refreshPositions(False)
-                        positionsRefreshed = True
 
-                    account.proccessAlert( alert )
-                    account.latchedAlerts.remove( alert )
+def ordersWorkerFrame( account: account_c ):
+    start = time.monotonic()
+    try:
+        with account.lock:
+            updateAccountOrdersQueue( account )
+            account.saveLocalState()
+    except Exception as e:
+        # don't let the exception kill the worker
+        account.print( ' * E: ordersWorker: Unhandled exception:', e, type(e) )
+    account.ordersTickStats.add( time.monotonic() - start )
+
+
+def updateAccountOrdersQueue( account: account_c ):
+    numOrders = len(account.ordersQueue) + len(account.activeOrders)
+    account.updateOrdersQueue()
+
+    # see if we have any alert pending to be proccessed
+    if( len(account.latchedAlerts) ):
+        refreshedSymbols = set()
+        for alert in list(account.latchedAlerts):
+            if( alert.get('delayTimestamp') != None ):
+                alert.get('delayTimestamp') < time.monotonic()
+                continue
+
+            if( not account.isSymbolBusy( alert['symbol'] ) ):
+                if( alert['symbol'] not in refreshedSymbols ):
+                    account.refreshSymbolPositions( [alert['symbol']], False )
+                    refreshedSymbols.add( alert['symbol'] )
+
+                account.proccessAlert( alert )
+                account.latchedAlerts.remove( alert )
 
-        # if we just cleared the orders queue refresh the positions info
-        if( numOrders > 0 and (len(account.ordersQueue) + len(account.activeOrders)) == 0 ):
-            account.refreshPositions(True)
+    # if we just cleared the orders queue refresh the positions info
+    if( numOrders > 0 and (len(account.ordersQueue) + len(account.activeOrders)) == 0 ):
+        account.refreshSymbolPositions( list(account.touchedSymbols), True )
 
 
+positionsTickStats = durationStats_c() # duration of the positions refresh timer frames
+
 def refreshPositions():
+    start = time.monotonic()
+    refreshAllPositions()
+    positionsTickStats.add( time.monotonic() - start )
+
+
+def refreshAllPositions():
     for account in accounts:
-        account.refreshPositions()
+        with account.lock: # the orders worker refreshes the positions of the symbols it touched
+            account.refreshPositions()
+        if SHOW_BALANCE:
+            # keep the balance of the positions page fresh too
+            try:
+                account.fetchBalance( 0 )
+            except Exception as e:
+                pass
 
 
-def generatePositionsString()->str:
+def logApiStats():
+    for account in accounts:
+        account.logApiStats()
+
+
+DASHBOARD_MIN_REFRESH = 10.0 # seconds. Asking the page to refresh doesn't refresh positions nor balances younger than this
+
+def refreshStalePositions( force = False ):
+    # the refresh timer keeps the positions up to date. Only refresh the accounts it left behind
+    for account in accounts:
+        age = time.time() - account.positionsTimestamp
+        if( age > DASHBOARD_MAX_STALENESS or ( force and age > DASHBOARD_MIN_REFRESH ) ):
+            with account.lock: # don't refresh them in the middle of an alert or an orders frame
+                account.refreshPositions()
+
+
+def generatePositionsString( refresh = False )->str:
+    refreshStalePositions( refresh )
     msg = ''
     for account in accounts:
-        account.refreshPositions()
         numPositions = len(account.positionslist)
         balanceString = ''
         if SHOW_BALANCE:
             try:
-                balance = account.fetchBalance()
+                balance = account.fetchBalance( DASHBOARD_MIN_REFRESH if refresh else DASHBOARD_MAX_STALENESS )
             except Exception as e:
                 balanceString = ''
             else:
@@ -1984,6 +3113,157 @@ def generatePositionsString()->str:
 
     return msg
 
+def runInDaemonThread( function, *args )->Future:
+    # like submitting to an executor, but the interpreter won't wait for the thread at exit.
+    # A hung exchange call must not block the shutdown
+    future = Future()
+    def run():
+        try:
+            future.set_result( function( *args ) )
+        except Exception as e:
+            future.set_exception( e )
+    Thread( target = run, daemon = True ).start()
+    return future
+
+
+def refreshAccountReport( account: account_c )->dict:
+    # a busy account makes us wait for the lock. The report marks it stale when it takes too long.
+    # Returns the balance: an order can drop the balance snapshot before the report reads it
+    with account.lock:
+        account.refreshPositions( False )
+        return account.fetchBalance()
+
+
+def generateAccountsReport( accountsList )->dict:
+    # refresh the accounts at once and wait for them up to ACCOUNT_REPORT_TIMEOUT.
+    # The accounts which didn't make it report their last known data marked as stale
+    futures = {}
+    for account in accountsList:
+        # don't pile up requests on an account which still didn't answer the last one
+        if( account.reportFuture == None or account.reportFuture.done() ):
+            account.reportFuture = runInDaemonThread( refreshAccountReport, account )
+        futures[account] = account.reportFuture
+    wait( futures.values(), timeout = ACCOUNT_REPORT_TIMEOUT )
+
+    package = {}
+    for account, future in futures.items():
+        error = None
+        balance = None
+        if( not future.done() ):
+            error = 'timed out'
+        elif( future.exception() != None ):
+            error = str( future.exception() )
+        else:
+            balance = future.result()
+
+        if( balance == None ):
+            # the last one we know of
+            snapshot = account.balanceSnapshot
+            balance = snapshot[1] if snapshot != None else None
+        report = { "positions": [pos.generateDictionary() for pos in account.positionslist],
+                    "balance": balance.get('total') if balance != None else None,
+                    "timestamp": account.positionsTimestamp,
+                    "stale": error != None or account.refreshPositionsFailed > 0 }
+        if( error != None ):
+            report["error"] = error
+        package[account.accountName] = report
+
+    return package
+
+def metricLabels( **labels )->str:
+    if( len(labels) == 0 ):
+        return ''
+    return '{' + ','.join( f'{key}="' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"' for key, value in labels.items() ) + '}'
+
+
+def writeHistogram( lines: list, name, histogram: histogram_c, **labels ):
+    cumulative = 0
+    for i, bound in enumerate( histogram.buckets ):
+        cumulative += histogram.counts[i]
+        lines.append( f'{name}_bucket{metricLabels( **labels, le=bound )} {cumulative}' )
+    lines.append( f'{name}_bucket{metricLabels( **labels, le="+Inf" )} {histogram.count}' )
+    lines.append( f'{name}_sum{metricLabels( **labels )} {histogram.total}' )
+    lines.append( f'{name}_count{metricLabels( **labels )} {histogram.count}' )
+
+
+def writeSummary( lines: list, name, stats: durationStats_c, **labels ):
+    for q in ( 0.5, 0.9, 0.99 ):
+        lines.append( f'{name}{metricLabels( **labels, quantile=q )} {stats.percentile( q * 100 )}' )
+    lines.append( f'{name}_sum{metricLabels( **labels )} {stats.total}' )
+    lines.append( f'{name}_count{metricLabels( **labels )} {stats.count}' )
+
+
+def generateMetrics()->str:
+    # Prometheus text format. Read without taking the accounts locks
+    lines = []
+    families = (
+        ( 'whook_alert_to_submit_seconds', 'histogram', 'Time from receiving an alert to the exchange accepting its order' ),
+        ( 'whook_submit_to_fill_seconds', 'histogram', 'Time from the exchange accepting an order to seeing it filled' ),
+        ( 'whook_orders_queue_depth', 'gauge', 'Orders waiting to be sent' ),
+        ( 'whook_active_orders', 'gauge', 'Orders sent and waiting to be filled' ),
+        ( 'whook_latched_alerts', 'gauge', 'Alerts waiting for their symbol to be free' ),
+        ( 'whook_order_retries_total', 'counter', 'Orders sent again after an error' ),
+        ( 'whook_order_timeouts_total', 'counter', 'Orders dropped after ORDER_TIMEOUT' ),
+        ( 'whook_refresh_positions_failures_total', 'counter', 'Failed positions refreshes' ),
+        ( 'whook_refresh_positions_failed_streak', 'gauge', 'Positions refreshes failed in a row' ),
+        ( 'whook_price_cache_hits_total', 'counter', 'Prices served from the top of book cache' ),
+        ( 'whook_price_cache_misses_total', 'counter', 'Prices fetched from the exchange' ),
+        ( 'whook_orders_tick_seconds', 'summary', 'Duration of the orders worker frames' ),
+    )
+    for name, kind, description in families:
+        lines.append( f'# HELP {name} {description}' )
+        lines.append( f'# TYPE {name} {kind}' )
+        for account in accounts:
+            if( name == 'whook_alert_to_submit_seconds' ):
+                writeHistogram( lines, name, account.submitLatency, account=account.accountName )
+            elif( name == 'whook_submit_to_fill_seconds' ):
+                writeHistogram( lines, name, account.fillLatency, account=account.accountName )
+            elif( name == 'whook_orders_tick_seconds' ):
+                writeSummary( lines, name, account.ordersTickStats, account=account.accountName )
+            else:
+                value = { 'whook_orders_queue_depth': len(account.ordersQueue),
+                         'whook_active_orders': len(account.activeOrders),
+                         'whook_latched_alerts': len(account.latchedAlerts),
+                         'whook_order_retries_total': account.orderRetries,
+                         'whook_order_timeouts_total': account.orderTimeouts,
+                         'whook_refresh_positions_failures_total': account.refreshPositionsFailures,
+                         'whook_refresh_positions_failed_streak': account.refreshPositionsFailed,
+                         'whook_price_cache_hits_total': account.priceCacheHits,
+                         'whook_price_cache_misses_total': account.priceCacheMisses }[name]
+                lines.append( f'{name}{metricLabels( account=account.accountName )} {value}' )
+
+    lines.append( '# HELP whook_positions_tick_seconds Duration of the positions refresh timer frames' )
+    lines.append( '# TYPE whook_positions_tick_seconds summary' )
+    writeSummary( lines, 'whook_positions_tick_seconds', positionsTickStats )
+    lines.append( '# HELP whook_exchange_call_seconds Duration of the exchange API calls' )
+    lines.append( '# TYPE whook_exchange_call_seconds summary' )
+    for account in accounts:
+        for name, callStats in list(account.apiStats.items()):
+            if( callStats.latency.count > 0 ):
+                writeSummary( lines, 'whook_exchange_call_seconds', callStats.latency, account=account.accountName, method=name )
+    lines.append( '# HELP whook_exchange_call_errors_total Failed exchange API calls by exception class' )
+    lines.append( '# TYPE whook_exchange_call_errors_total counter' )
+    for account in accounts:
+        for name, callStats in list(account.apiStats.items()):
+            for error, count in list(callStats.errors.items()):
+                lines.append( f'whook_exchange_call_errors_total{metricLabels( account=account.accountName, method=name, error=error )} {count}' )
+    lines.append( '# HELP whook_exchange_response_bytes_total Size of the exchange API responses' )
+    lines.append( '# TYPE whook_exchange_response_bytes_total counter' )
+    for account in accounts:
+        for name, callStats in list(account.apiStats.items()):
+            if( callStats.latency.count > 0 ):
+                lines.append( f'whook_exchange_response_bytes_total{metricLabels( account=account.accountName, method=name )} {callStats.bytes}' )
+
+    if ASYNC_ALERTS:
+        lines.append( '# HELP whook_alerts_queue_depth Alerts received and waiting for a worker' )
+        lines.append( '# TYPE whook_alerts_queue_depth gauge' )
+        lines.append( f'whook_alerts_queue_depth {alertsQueueDepth()}' )
+        lines.append( '# HELP whook_alert_processing_seconds Time from receiving an alert to finishing processing it' )
+        lines.append( '# TYPE whook_alert_processing_seconds summary' )
+        writeSummary( lines, 'whook_alert_processing_seconds', alertLatency )
+
+    return '\n'.join( lines ) + '\n'
+
 def createAlertTemplate( msg = None ):
         return {
             'symbol': None,
@@ -2001,78 +3281,119 @@ def createAlertTemplate( msg = None ):
             'timestamp':time.monotonic()
         }
 
-def parseAlert( data, account: account_c ):
+# keywords of the alert syntax and the alert field they set
+ALERT_KEYWORDS = {
+    'force_usdt': ( 'isUSDT', True ),
+    'force_percent': ( 'isPercentage', True ),
+    'force_basecurrency': ( 'isBaseCurrency', True ),
+    'nominal': ( 'nominal', True ),
+    'bclock': ( 'nominal', True ),
+    'collateral': ( 'nominal', False ),
+    'long': ( 'command', 'buy' ),
+    'short': ( 'command', 'sell' ),
+    'buy': ( 'command', 'buy' ),
+    'sell': ( 'command', 'sell' ),
+    'close': ( 'command', 'close' ),
+    'position': ( 'command', 'position' ),
+    'pos': ( 'command', 'position' ),
+    'changeleverage': ( 'command', 'changeleverage' ),
+    'reduce': ( 'reduce', True ),
+    'reduceonly': ( 'reduce', True ),
+}
+DEPRECATED_KEYWORDS = ( 'long', 'short' )
+QUANTITY_MARKS = ( '$', '@', '%' )  # value in USDT, in contracts and in percentage of balance
+LEVERAGE_TOKEN = re.compile( r'^x|x$' )
+ALERTS_CACHE_SIZE = 1024
+
+def parseAlert( data, account: account_c, timestamp = None ):
+    # timestamp: when the alert was received. Now by default
 
     if( account == None ):
         return { 'Error': " * E: parseAlert called without an account" }
-    
+
+    # the same alerts are sent over and over. Reuse the result of the last time we parsed them
+    cached = account.alertsCache.get( data )
+    if( cached != None ):
+        alert = dict( cached )
+        if( alert.get('Error') == None ):
+            alert['timestamp'] = time.monotonic() if timestamp == None else timestamp
+        if verbose : print( alert )
+        return alert
+
+    alert = parseAlertTokens( data, account )
+    if( timestamp != None and alert.get('Error') == None ):
+        alert['timestamp'] = timestamp
+
+    alertsCache = account.alertsCache
+    if( len(alertsCache) >= ALERTS_CACHE_SIZE ):
+        alertsCache.clear()
+    alertsCache[data] = dict( alert )
+
+    if verbose and alert.get('Error') == None : print( alert )
+    return alert
+
+
+def parseAlertTokens( data, account: account_c ):
+
     alert = createAlertTemplate(data)
 
     limitToken = None
     cancelToken = None
+    accountName = account.accountName.lower()
 
     # Informal plain text syntax
     tokens = data.split()
     for token in tokens:
-        if( account.findSymbolFromPairName(token) != None ): # BTCUSDTM, BTC/USDT:USDT and BTC/USDT are all acceptable formats
-            alert['symbol'] = account.findSymbolFromPairName(token) 
-        elif ( token.lower() == account.accountName.lower() ):
-            pass
-        elif ( token[:1].lower() == "$" or token[-1:] == "$" ): # value in USDT
-            alert['isUSDT'] = True
-            arg = token.lower().strip().replace("$", "")
-            alert['quantity'] = stringToValue( arg )
-        elif ( token[:1].lower() == "@" or token[-1:] == "@" ): # value in contracts
-            arg = token.lower().strip().replace("@", "")
-            alert['quantity'] = stringToValue( arg )
-        elif ( token[:1].lower() == "%" or token[-1:] == "%" ): # value in percentage of balance
-            arg = token.lower().strip().replace("%", "")
-            alert['quantity'] = stringToValue( arg )
-            alert['isPercentage'] = True
-        elif ( token[:1]  == "-" ): # this is a minus symbol! What a bitch (value in base currency)
+        symbol = account.findSymbolFromPairName(token)
+        if( symbol != None ): # BTCUSDTM, BTC/USDT:USDT and BTC/USDT are all acceptable formats
+            alert['symbol'] = symbol
+            continue
+
+        lowerToken = token.lower()
+        if ( lowerToken == accountName or lowerToken == ALL_ACCOUNTS ):
+            continue
+
+        keyword = ALERT_KEYWORDS.get( lowerToken )
+        if( keyword != None ):
+            alert[keyword[0]] = keyword[1]
+            if( lowerToken in DEPRECATED_KEYWORDS ):
+                print( "WARNING: 'long' and 'short' commands are deprecated and will be removed in the future. Please use 'buy' and 'sell' instead" )
+            continue
+
+        first = token[:1]
+        last = token[-1:]
+        mark = None
+        for m in QUANTITY_MARKS:
+            if( first == m or last == m ):
+                mark = m
+                break
+
+        if( mark != None ):
+            alert['quantity'] = stringToValue( lowerToken.replace( mark, "" ) )
+            if( mark == '$' ): # value in USDT
+                alert['isUSDT'] = True
+            elif( mark == '%' ): # value in percentage of balance
+                alert['isPercentage'] = True
+            continue
+
+        if ( first == "-" ): # this is a minus symbol! What a bitch (value in base currency)
             alert['isBaseCurrency'] = True
-            arg = token.lstrip('-')
-            val = stringToValue( arg )
+            val = stringToValue( token.lstrip('-') )
             alert['quantity'] = -val if val is not None else None
-        elif ( stringToValue( token ) != None ):
-            alert['isBaseCurrency'] = True
-            arg = token
-            alert['quantity'] = stringToValue(arg)
-        elif token.lower()  == 'force_usdt':
-            alert['isUSDT'] = True
-        elif token.lower()  == 'force_percent':
-            alert['isPercentage'] = True
-        elif token.lower()  == 'force_basecurrency':
+            continue
+
+        value = stringToValue( token )
+        if ( value != None ):
             alert['isBaseCurrency'] = True
-        elif token.lower()  == 'nominal' or token.lower() == "bclock":
-            alert['nominal'] = True
-        elif token.lower()  == 'collateral':
-            alert['nominal'] = False
-        elif ( token[:1].lower() == "x" or token[-1:].lower() == "x"):
-            arg = token.lower().strip().replace("x", "")
-            leverage = stringToValue(arg)
+            alert['quantity'] = value
+            continue
+
+        if ( LEVERAGE_TOKEN.search( lowerToken ) ):
+            leverage = stringToValue( lowerToken.replace("x", "") )
             alert['leverage'] = int(leverage) if leverage is not None else 0
-        elif token.lower()  == 'long':
-            alert['command'] = 'buy'
-            print( "WARNING: 'long' and 'short' commands are deprecated and will be removed in the future. Please use 'buy' and 'sell' instead" )
-        elif token.lower()  == 'short':
-            alert['command'] = 'sell'
-            print( "WARNING: 'long' and 'short' commands are deprecated and will be removed in the future. Please use 'buy' and 'sell' instead" )
-        elif token.lower() == "buy":
-            alert['command'] = 'buy'
-        elif token.lower() == "sell":
-            alert['command'] = 'sell'
-        elif token.lower()  == 'close':
-            alert['command'] = 'close'
-        elif token.lower()  == 'position' or token.lower()  == 'pos':
-            alert['command'] = 'position'
-        elif token.lower()  == 'changeleverage':
-            alert['command'] = 'changeleverage'
-        elif token.lower()  == 'reduce' or token.lower()  == 'reduceonly':
-            alert['reduce'] = True
-        elif ( token[:5].lower()  == "limit" ):
+        elif ( lowerToken[:5] == "limit" ):
             limitToken = token # we validate it at processing
-        elif ( token[:6].lower()  == "cancel" ):
+        elif ( lowerToken[:6] == "cancel" ):
             cancelToken = token # we validate it at processing
             alert['command'] = 'cancel'
         else:
@@ -2144,14 +3465,48 @@ def parseAlert( data, account: account_c ):
         if( account.exchange.id == 'coinex' and not alert['customID'].isdigit() ):
             return { 'Error': " * E: Coinex only accepts numeric customID' " }
 
-    if verbose : print( alert )
     return alert
 
 
 
-def Alert( data ):
+def rebuildAccountsIndex():
+    global accountsByName
+    index = {}
+    for a in accounts:
+        index.setdefault( a.accountName.lower(), a )
+    accountsByName = index
+
+
+def dispatchAlert( line, account: account_c, timestamp = None ):
+    with account.lock:
+        proccessAlertLine( line, account, timestamp )
+
 
-    account = None
+def printAlertError( line, account: account_c, error ):
+    account.print( ' ' )
+    account.print( " ALERT:", line )
+    account.print('----------------------------')
+    account.print( error )
+
+
+def proccessAlertLine( line, account: account_c, timestamp = None ):
+    alert = parseAlert( line, account, timestamp )
+    if( alert.get('Error') != None ):
+        printAlertError( line, account, alert.get('Error') )
+        return
+
+    # check if the alert can be proccessed inmediately
+    if( not account.isSymbolBusy( alert['symbol'] ) ):
+        account.proccessAlert( alert )
+        return
+    
+    # delay the alert proccessing
+    account.latchedAlerts.append( alert )
+
+
+def routeAlert( data )->list:
+    # split the alert in lines and find the accounts each line goes to. Returns a list of ( line, account )
+    routes = []
 
     # first lets find out if there's more than one commands inside the alert message
     lines = data.split("\n")
@@ -2162,41 +3517,90 @@ def Alert( data ):
         if( line[:2] == '//' ): # if the line begins with // it's a comment and we skip it
             continue
         account = None
+        targets = None
         tokens = line.split()
         for token in tokens:
-            for a in accounts:
-                if( token.lower() == a.accountName.lower() ):
-                    account = a
-                    break
-        if( account == None ): 
+            token = token.lower()
+            if( token == ALL_ACCOUNTS ):
+                targets = list(accounts)
+                continue
+            a = accountsByName.get( token )
+            if( a != None ):
+                account = a
+        if( targets == None and account != None ):
+            targets = [ account ]
+        if( targets == None ): 
             print( timeNow(), ' * E: Account ID not found. ALERT:', line )
             continue
-        
-        alert = parseAlert( line.replace('\n', ''), account )
+
+        for account in targets:
+            routes.append( ( line, account ) )
+
+    return routes
+
+
+def Alert( data ):
+    now = time.monotonic()
+    for line, account in routeAlert( data ):
+        dispatchAlert( line, account, now )
+
+
+# one queue for each alerts worker. The alerts of an account always go to the same queue
+alertsQueues = [ queue.Queue() for i in range( max( ALERT_WORKERS, 1 ) ) ]
+alertsQueueLock = RLock()
+alertLatency = durationStats_c()
+
+def alertsQueueDepth()->int:
+    return sum( q.qsize() for q in alertsQueues )
+
+
+def queueAlert( data ):
+    # returns None when the alert was queued, or the ( message, status ) to answer the webhook with
+    routes = routeAlert( data )
+    if( len(routes) == 0 ):
+        return ( 'account not found', 400 )
+
+    # alerts which can't be parsed are reported now instead of going through the queue
+    valid = []
+    for line, account in routes:
+        alert = parseAlert( line, account )
         if( alert.get('Error') != None ):
-            account.print( ' ' )
-            account.print( " ALERT:", line.replace('\n', '') )
-            account.print('----------------------------')
-            account.print( alert.get('Error') )
+            printAlertError( line, account, alert.get('Error') )
             continue
+        valid.append( ( line, account ) )
+    if( len(valid) == 0 ):
+        return ( 'invalid alert', 400 )
+
+    with alertsQueueLock: # the alert is queued whole or not at all, and in the order it arrived
+        if( alertsQueueDepth() + len(valid) > ALERT_QUEUE_SIZE ):
+            print( timeNow(), ' * E: Alerts queue is full. Alert rejected:', data )
+            return ( 'busy', 503 )
+        now = time.monotonic()
+        for line, account in valid:
+            alertsQueues[ accounts.index( account ) % len(alertsQueues) ].put( ( line, account, now ) )
+    return None
+
+
+def alertsWorker( alertsQueue: queue.Queue ):
+    while True:
+        item = alertsQueue.get()
+        if( item == None ): # told to exit
+            alertsQueue.task_done()
+            return
+        line, account, receivedTimestamp = item
+        try:
+            dispatchAlert( line, account, receivedTimestamp ) # the time waiting in the queue counts too
+        except Exception as e:
+            print( timeNow(), ' * E: alertsWorker: Unhandled exception:', e, type(e) )
+        latency = time.monotonic() - receivedTimestamp
+        alertLatency.add( latency )
+        if verbose : print( timeNow(), " * Alert processed in {:.3f}s".format( latency ) )
+        alertsQueue.task_done()
 
-        # check if the alert can be proccessed inmediately
-        busy = False
-        for o in account.activeOrders:
-            if( o.symbol == alert['symbol'] ):
-                busy = True
-                break
-        for o in account.ordersQueue:
-            if( o.symbol == alert['symbol'] ):
-                busy = True
-                break
-        
-        if( not busy ):
-            account.proccessAlert( alert )
-            continue
-        
-        # delay the alert proccessing
-        account.latchedAlerts.append( alert )
+
+def startAlertsWorkers():
+    for i, alertsQueue in enumerate( alertsQueues ):
+        Thread( target = alertsWorker, args = ( alertsQueue, ), name = f'alerts{i}', daemon = True ).start()
 
 
 
@@ -2204,48 +3608,48 @@ def Alert( data ):
 #### Initialize ###
 ###################
 
-print('----------------------------')
-
 #### Open accounts file ###
 
-try:
-    with open('accounts.json', 'r') as accounts_file:
-        accounts_data = json.load(accounts_file)
-        accounts_file.close()
-except FileNotFoundError:
-    with open('accounts.json', 'x') as f:
-        f.write( '[\n\t{\n\t\t"ACCOUNT_ID":"your_account_name", \n\t\t"EXCHANGE":"exchange_name", \n\t\t"API_KEY":"your_api_key", \n\t\t"SECRET_KEY":"your_secret_key", \n\t\t"PASSWORD":"your_API_password", \n\t\t"MARGIN_MODE":"isolated"\n\t}\n]' )
-        f.close()
-    print( "File 'accounts.json' not found. Template created. Please fill your API Keys into the file and try again")
-    print( "Exiting." )
-    raise SystemExit()
-
-for ac in accounts_data:
-
+def loadAccountsFile()->list:
+    print('----------------------------')
+    try:
+        with open('accounts.json', 'r') as accounts_file:
+            accounts_data = json.load(accounts_file)
+            accounts_file.close()
+    except FileNotFoundError:
+        with open('accounts.json', 'x') as f:
+            f.write( '[\n\t{\n\t\t"ACCOUNT_ID":"your_account_name", \n\t\t"EXCHANGE":"exchange_name", \n\t\t"API_KEY":"your_api_key", \n\t\t"SECRET_KEY":"your_secret_key", \n\t\t"PASSWORD":"your_API_password", \n\t\t"MARGIN_MODE":"isolated"\n\t}\n]' )
+            f.close()
+        print( "File 'accounts.json' not found. Template created. Please fill your API Keys into the file and try again")
+        print( "Exiting." )
+        raise SystemExit()
+    return accounts_data
+
+def parseAccountData( ac )->dict:
     exchange = ac.get('EXCHANGE')
     if( exchange == None ):
         print( " * ERROR PARSING ACCOUNT INFORMATION: EXCHANGE" )
-        continue
+        return None
 
     account_id = ac.get('ACCOUNT_ID')
     if( account_id == None ):
         print( " * ERROR PARSING ACCOUNT INFORMATION: ACCOUNT_ID" )
-        continue
+        return None
 
     api_key = ac.get('API_KEY')
     if( api_key == None ):
         print( " * ERROR PARSING ACCOUNT INFORMATION: API_KEY" )
-        continue
+        return None
 
     secret_key = ac.get('SECRET_KEY')
     if( secret_key == None ):
         print( " * ERROR PARSING ACCOUNT INFORMATION: SECRET_KEY" )
-        continue
+        return None
 
     password = ac.get('PASSWORD')
     if( password == None ):
         password = ""
-        continue
+        return None
 
     marginMode = ac.get('MARGIN_MODE')
 
@@ -2254,18 +3658,92 @@ for ac in accounts_data:
 
     settleCoin = ac.get('SETTLE_COIN')
 
-    print( timeNow(), " Initializing account: [", account_id, "] in [", exchange , ']')
+    return { 'exchange':exchange, 'name':account_id, 'apiKey':api_key, 'secret':secret_key, 'password':password,
+             'marginMode':marginMode, 'hedgedMode':hedged, 'settleCoin':settleCoin }
+
+
+def createAccount( accountData, report:dict ):
+    report['start'] = time.monotonic()
+    print( timeNow(), " Initializing account: [", accountData['name'], "] in [", accountData['exchange'] , ']')
     try:
-        account = account_c( exchange, account_id, api_key, secret_key, password, marginMode, hedged, settleCoin )
+        account = account_c( **accountData )
     except Exception as e:
+        report['error'] = f'{e} {type(e)}'
         print( 'Account creation failed:', e, type(e) )
         print('------------------------------')
+        account = None
+    report['end'] = time.monotonic()
+    return account
+
+
+def initializeAccounts( accountsData ):
+    validData = []
+    for ac in accountsData:
+        accountData = parseAccountData( ac )
+        if( accountData != None ):
+            validData.append( accountData )
+
+    reports = [ { 'name':d['name'], 'exchange':d['exchange'], 'start':None, 'end':None, 'error':None } for d in validData ]
+    results = [ None ] * len(validData)
+
+    if( INIT_THREADS <= 1 ):
+        for i, accountData in enumerate(validData):
+            results[i] = createAccount( accountData, reports[i] )
     else:
-        accounts.append( account )
+        # daemon threads instead of an executor: the interpreter waits for the executor threads at exit,
+        # so an account hung on its exchange would block the shutdown
+        indices = queue.Queue()
+        created = [ None ] * len(validData)
+        for i in range(len(validData)):
+            indices.put( i )
+
+        def initWorker():
+            while True:
+                try:
+                    i = indices.get_nowait()
+                except queue.Empty:
+                    return
+                created[i] = createAccount( validData[i], reports[i] )
+
+        def startInitWorker():
+            Thread( target = initWorker, name = 'init', daemon = True ).start()
+
+        for _ in range( min(INIT_THREADS, len(validData)) ):
+            startInitWorker()
+
+        # give up on the accounts which are taking too long. Their threads are left running but the
+        # accounts won't be used. A new thread takes their place so the remaining accounts don't wait
+        givenUp = set()
+        while True:
+            now = time.monotonic()
+            pending = 0
+            for i, report in enumerate(reports):
+                if( report['end'] != None or i in givenUp ):
+                    continue
+                if( report['start'] != None and report['start'] + INIT_TIMEOUT < now ):
+                    report['error'] = 'timed out'
+                    givenUp.add( i )
+                    startInitWorker()
+                    continue
+                pending += 1
+            if( pending == 0 ):
+                break
+            time.sleep( 0.5 )
+        results = [ None if i in givenUp else account for i, account in enumerate(created) ]
+
+    # startup report
+    print('------------------------------')
+    print( timeNow(), " Accounts initialization report:" )
+    for i, report in enumerate(reports):
+        elapsed = '   ---' if report['start'] == None else "{:6.2f}s".format( (report['end'] if report['end'] != None else time.monotonic()) - report['start'] )
+        status = 'OK' if results[i] != None else f"FAILED: {report['error']}"
+        print( f"  [{report['name']}/{report['exchange']}]".ljust(30), elapsed, status )
+    print('------------------------------')
 
-if( len(accounts) == 0 ):
-    print( " * FATAL ERROR: No valid accounts found. Please edit 'accounts.json' and introduce your API keys" )
-    raise SystemExit()
+    for account in results:
+        if( account != None ):
+            accounts.append( account )
+    rebuildAccountsIndex()
 
 
 ############################################
@@ -2284,6 +3762,19 @@ if USE_PROXY == True:
     )
     PORT = PROXY_PORT
 
+@app.route('/apistats', methods=['GET'])
+def apistats():
+    # https://0.0.0.0/apistats: timings of the exchange API calls of each account and how often the prices cache saved one
+    return jsonify( { account.accountName: { 'calls': account.generateApiStats(),
+                                             'priceCache': { 'hits': account.priceCacheHits, 'misses': account.priceCacheMisses } }
+                     for account in accounts } )
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return app.response_class( generateMetrics(), content_type='text/plain; version=0.0.4; charset=utf-8' )
+
+
 @app.route('/whook', methods=['GET','POST'])
 def webhook():
 
@@ -2306,6 +3797,14 @@ def webhook():
         
         # Standard alert
         data = request.get_data(as_text=True)
+        if ASYNC_ALERTS:
+            if( len(data.strip()) == 0 ):
+                return 'empty alert', 400
+            error = queueAlert( data )
+            if( error != None ):
+                return error
+            return 'success', 200
+
         Alert(data)
         return 'success', 200
     
@@ -2313,6 +3812,8 @@ def webhook():
         # https://0.0.0.0/whook
         response = request.args.get('response')
         if( response == None ):
+            # https://0.0.0.0/whook?refresh=1 skips the positions snapshot (unless it was taken seconds ago)
+            refresh = request.args.get('refresh', '').lower() in ( '1', 'true' )
             fontSize = 18
             if fontSize > 0:
                 msg = f"""
@@ -2322,34 +3823,31 @@ def webhook():
                     <title>Positions</title>
                 </head>
                 <body>
-                    <pre style="font-size: {fontSize}px;">{generatePositionsString()}</pre>
+                    <pre style="font-size: {fontSize}px;">{generatePositionsString( refresh )}</pre>
                 </body>
                 </html>
                 """
-                return app.response_class( msg, mimetype='text/html; charset=utf-8' )
+                page = app.response_class( msg, mimetype='text/html; charset=utf-8' )
             else:
-                msg = generatePositionsString()
-                return app.response_class( msg, mimetype='text/plain; charset=utf-8' )
+                msg = generatePositionsString( refresh )
+                page = app.response_class( msg, mimetype='text/plain; charset=utf-8' )
+
+            # pollers sending back the ETag get a 304 while nothing changed
+            page.set_etag( hashlib.sha1( msg.encode() ).hexdigest() )
+            return page.make_conditional( request )
         
         if response == 'whook':
             return 'WHOOKITYWOOK'
         
         # https://0.0.0.0/whook?response=account
-        if response.lower() == 'allaccounts':
-            package = {"allaccounts": {}}
-            for acc in accounts:
-                acc.refreshPositions(False)
-                package["allaccounts"][acc.accountName] = { "positions": [pos.generateDictionary() for pos in acc.positionslist],
-                                                            "balance": acc.fetchBalance().get('total') }
+        if response.lower() == ALL_ACCOUNTS:
+            package = {"allaccounts": generateAccountsReport( accounts )}
             return jsonify(package)
         else:
-            package = {"allaccounts": {}}
-            for acc in accounts:
-                if acc.accountName.lower() == response.lower():
-                    acc.refreshPositions(False) 
-                    package["allaccounts"][acc.accountName] = { "positions": [pos.generateDictionary() for pos in acc.positionslist],
-                                                                "balance": acc.fetchBalance().get('total') }
-                    return jsonify(package)
+            acc = accountsByName.get( response.lower() )
+            if( acc != None ):
+                package = {"allaccounts": generateAccountsReport( [acc] )}
+                return jsonify(package)
 
         # temporarily disabled.
         # Return the requested log file
@@ -2365,16 +3863,58 @@ def webhook():
     else:
         abort(400)
 
-# start the positions fetching loop
-timerFetchPositions = RepeatTimer( REFRESH_POSITIONS_FREQUENCY, refreshPositions )
-timerFetchPositions.start()
+timers = []
+
+def startTimers():
+    # start the positions fetching loop
+    timers.append( RepeatTimer( REFRESH_POSITIONS_FREQUENCY, refreshPositions ) )
+
+    if( API_STATS_LOG_FREQUENCY > 0 ):
+        timers.append( RepeatTimer( API_STATS_LOG_FREQUENCY, logApiStats ) )
+
+    # each account processes its own orders queue so a hanging exchange doesn't stall the others
+    for account in accounts:
+        timer = RepeatTimer( UPDATE_ORDERS_FREQUENCY, ordersWorkerFrame, [account] )
+        timer.name = f'orders_{account.accountName}'
+        timers.append( timer )
+
+    for timer in timers:
+        timer.start()
 
-timerOrdersQueue = RepeatTimer( UPDATE_ORDERS_FREQUENCY, updateOrdersQueue )
-timerOrdersQueue.start()
+    if ASYNC_ALERTS:
+        startAlertsWorkers()
 
-# start the webhook server
+
+def shutdown():
+    for timer in timers:
+        timer.cancel()
+    for account in accounts:
+        account.saveLocalState()
+    if ASYNC_ALERTS:
+        for alertsQueue in alertsQueues:
+            alertsQueue.put( None )
+    if( asyncRuntime != None ):
+        for account in accounts:
+            if( account.orderStream != None ):
+                account.orderStream.stop()
+            if( account.asyncExchange != None ):
+                asyncRuntime.gather( account.asyncExchange.close() )
+        asyncRuntime.stop()
+    logListener.stop() # writes what's left in the queue
+
+# start the webhook server. Importing the module (benchmarks) doesn't create any account
 if __name__ == '__main__':
+    initializeAccounts( loadAccountsFile() )
+
+    if( len(accounts) == 0 ):
+        print( " * FATAL ERROR: No valid accounts found. Please edit 'accounts.json' and introduce your API keys" )
+        raise SystemExit()
+
+    startTimers()
     print( " * Listening" )
-    app.run(host="0.0.0.0", port=PORT, debug=False)
+    try:
+        app.run(host="0.0.0.0", port=PORT, debug=False)
+    finally:
+        shutdown()
 
 